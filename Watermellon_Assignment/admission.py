@@ -0,0 +1,109 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple
+
+# HTTP status per rejection reason: a full endpoint queue asks the client to slow down, the others
+# mean this worker cannot take the request right now
+REJECT_STATUS = {'queue_full': 429, 'queue_timeout': 503, 'overloaded': 503}
+
+class _Gate:
+    __slots__ = ('name', 'concurrency', 'queue_size', 'in_flight', 'waiters', 'admitted', 'rejected',
+                 'service_ewma')
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.in_flight = 0
+        # FIFO of waiting requests; a released slot is handed to the oldest waiter directly
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0, 'overloaded': 0}
+        self.service_ewma = 0.05
+
+class AdmissionController:
+    # Per-endpoint concurrency limits with bounded FIFO wait queues. capacity caps running plus queued
+    # heavy requests across all endpoints, so a thread-per-request server always keeps some threads
+    # free for cheap routes such as /health.
+    def __init__(self, capacity: int = None, queue_timeout: float = 2.0):
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self._gates: Dict[str, _Gate] = {}
+        self._lock = threading.Lock()
+        self._occupied = 0
+
+    def add_endpoint(self, name: str, concurrency: int, queue_size: int):
+        self._gates[name] = _Gate(name, concurrency, queue_size)
+
+    def acquire(self, name: str) -> Tuple[float, Dict]:
+        # Returns (admitted_at, None) on admission, to be passed back to release(), or
+        # (None, rejection) without waiting longer than queue_timeout
+        gate = self._gates[name]
+        with self._lock:
+            if self.capacity is not None and self._occupied >= self.capacity:
+                return None, self._reject(gate, 'overloaded')
+            if gate.in_flight < gate.concurrency and not gate.waiters:
+                gate.in_flight += 1
+                gate.admitted += 1
+                self._occupied += 1
+                return time.perf_counter(), None
+            if len(gate.waiters) >= gate.queue_size:
+                return None, self._reject(gate, 'queue_full')
+            turn = threading.Event()
+            gate.waiters.append(turn)
+            self._occupied += 1
+        if not turn.wait(self.queue_timeout):
+            with self._lock:
+                # The slot may have been handed over between the timeout and taking the lock
+                if not turn.is_set():
+                    gate.waiters.remove(turn)
+                    self._occupied -= 1
+                    return None, self._reject(gate, 'queue_timeout')
+        with self._lock:
+            gate.admitted += 1
+        return time.perf_counter(), None
+
+    def release(self, name: str, admitted_at: float):
+        gate = self._gates[name]
+        elapsed = time.perf_counter() - admitted_at
+        with self._lock:
+            gate.service_ewma += 0.1 * (elapsed - gate.service_ewma)
+            self._occupied -= 1
+            if gate.waiters:
+                # in_flight stays the same: the slot moves to the next waiter
+                gate.waiters.popleft().set()
+            else:
+                gate.in_flight -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'occupied': self._occupied,
+                'endpoints': {
+                    name: {
+                        'concurrency': gate.concurrency,
+                        'queue_size': gate.queue_size,
+                        'in_flight': gate.in_flight,
+                        'queued': len(gate.waiters),
+                        'admitted': gate.admitted,
+                        'rejected': dict(gate.rejected),
+                        'service_avg_ms': round(1000 * gate.service_ewma, 3)
+                    }
+                    for name, gate in self._gates.items()
+                }
+            }
+
+    def _reject(self, gate: _Gate, reason: str) -> Dict:
+        # Called with the lock held. Retry-After is the time for the current queue to drain at the
+        # observed service rate, in whole seconds.
+        gate.rejected[reason] += 1
+        backlog = len(gate.waiters) + gate.in_flight + 1
+        return {
+            'endpoint': gate.name,
+            'reason': reason,
+            'status': REJECT_STATUS[reason],
+            'retry_after': max(1, math.ceil(backlog * gate.service_ewma / gate.concurrency))
+        }
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from dispatcher import SideEffectDispatcher
+from metrics import REGISTRY
+
+RISK_ORDER = {'normal': 0, 'high': 1, 'critical': 2}
+
+def default_recipients(alert: Dict) -> List[str]:
+    # Procurement sees every alert; suppliers are only paged for critical shortages
+    if alert['risk_level'] == 'critical':
+        return ['procurement', 'suppliers']
+    return ['procurement']
+
+class AlertAggregator:
+    # Sits between the forecast pipeline and the dispatcher. A product alerts once per dedup window
+    # unless its risk gets worse; accepted alerts are coalesced and sent as one digest per recipient
+    # every digest_interval seconds.
+    def __init__(self, dispatcher: SideEffectDispatcher, dedup_window: float = 6 * 3600,
+                 digest_interval: float = 60.0, recipients: Callable[[Dict], List[str]] = default_recipients,
+                 destination: str = 'inventory', clock: Callable[[], float] = time.time):
+        self.dispatcher = dispatcher
+        self.dedup_window = dedup_window
+        self.digest_interval = digest_interval
+        self.recipients = recipients
+        self.destination = destination
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last_sent: Dict[str, tuple] = {}
+        self._pending: Dict[str, Dict[str, Dict]] = {}
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {'received': 0, 'suppressed': 0, 'escalations': 0, 'alerts_sent': 0, 'digests_sent': 0}
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+        threading.Thread(target=self._run, name="alert-digest", daemon=True).start()
+
+    def offer(self, alert: Dict) -> str:
+        # Returns 'queued', 'escalated' or 'suppressed'
+        if self._pid != os.getpid():
+            self.start()
+        product_id = alert['product_id']
+        level = RISK_ORDER.get(alert['risk_level'], 0)
+        now = self.clock()
+        with self._lock:
+            self._stats['received'] += 1
+            last = self._last_sent.get(product_id)
+            if last is not None and now - last[1] < self.dedup_window and level <= last[0]:
+                self._stats['suppressed'] += 1
+                return 'suppressed'
+            escalated = last is not None and now - last[1] < self.dedup_window
+            self._last_sent[product_id] = (level, now)
+            alert = dict(alert, escalation=escalated, raised_at=datetime.now().isoformat())
+            for recipient in self.recipients(alert):
+                # A later alert for the same product replaces the queued one in the digest
+                self._pending.setdefault(recipient, {})[product_id] = alert
+            if escalated:
+                self._stats['escalations'] += 1
+                return 'escalated'
+            return 'queued'
+
+    def resolve(self, product_id: str):
+        # Inventory is back above threshold, so the next shortage alerts again immediately
+        if product_id in self._last_sent:
+            with self._lock:
+                self._last_sent.pop(product_id, None)
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        digests = []
+        generated_at = datetime.now().isoformat()
+        for recipient, alerts in pending.items():
+            ordered = sorted(alerts.values(), key=lambda alert: -RISK_ORDER.get(alert['risk_level'], 0))
+            digests.append({
+                'recipient': recipient,
+                'generated_at': generated_at,
+                'alert_count': len(ordered),
+                'alerts': ordered
+            })
+        if digests:
+            self.dispatcher.submit_many(self.destination, digests)
+            alert_count = sum(digest['alert_count'] for digest in digests)
+            REGISTRY.inc('watermelon_alerts_total', alert_count, type='inventory_digest')
+            with self._lock:
+                self._stats['digests_sent'] += len(digests)
+                self._stats['alerts_sent'] += alert_count
+        return len(digests)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats,
+                        pending=sum(len(alerts) for alerts in self._pending.values()),
+                        tracked_products=len(self._last_sent))
+
+    def _run(self):
+        while not self._stop.wait(self.digest_interval):
+            self.flush()
@@ -1,35 +1,421 @@
-from flask import Flask, request, jsonify
+import atexit
+import json
+import os
+from functools import wraps
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
+from admission import AdmissionController
 from automation_system import WatermelonAutomationSystem
+from batch_runner import chunked, score_records
+from extraction import DocumentExtractionStage, load_extractor, local_extractor
+from metrics import REGISTRY
+from persistence import SQLitePersistence
+from profiling import configured_profiler, install as install_profiling
+from rules import RulesEngine
+from sharding import ShardedAutomationSystem
+from worker_state import WorkerState
 
 app = Flask(__name__)
 CORS(app)
 
-system = WatermelonAutomationSystem()
+# One instance per process; the system serializes access to its own state, so it can be shared
+# by every request thread of this worker
+def _persistence():
+    # State survives restarts when WATERMELON_DB points at a SQLite file
+    path = os.environ.get('WATERMELON_DB')
+    if not path:
+        return None
+    return SQLitePersistence(path, snapshot_dir=os.environ.get('WATERMELON_SNAPSHOT_DIR'),
+                             snapshot_interval=float(os.environ.get('WATERMELON_SNAPSHOT_INTERVAL', 3600)))
+
+# WATERMELON_RULES names a decision-table JSON file; every worker polls it and swaps in edits
+rules = RulesEngine(os.environ.get('WATERMELON_RULES'),
+                    poll_interval=float(os.environ.get('WATERMELON_RULES_POLL_INTERVAL', 2)))
+if rules.last_error:
+    raise RuntimeError(f"cannot load rules: {rules.last_error}")
+
+def _extraction_config():
+    # WATERMELON_EXTRACTOR swaps the built-in local extractor for another 'module:function'
+    env = os.environ.get
+    return {
+        'extractor': env('WATERMELON_EXTRACTOR'),
+        'extract_workers': int(env('WATERMELON_EXTRACT_WORKERS', 0)) or None,
+        'extract_timeout': float(env('WATERMELON_EXTRACT_TIMEOUT', 10)),
+        'extract_cache_dir': env('WATERMELON_EXTRACT_CACHE_DIR')
+    }
+
+def _system():
+    # WATERMELON_SHARDS > 1 partitions buyers and products across that many processes behind this one
+    if int(os.environ.get('WATERMELON_WORKERS', 1)) > 1:
+        # Every worker would keep its own idempotency cache, top-K views, alert dedup, rescore queue and
+        # supplier id sequence (and share one database), so answers would depend on the worker hit
+        raise RuntimeError("the API needs a single worker process (WATERMELON_WORKERS=1); "
+                           "scale with threads or WATERMELON_SHARDS")
+    shards = int(os.environ.get('WATERMELON_SHARDS', 1))
+    extraction = _extraction_config()
+    if shards <= 1:
+        stage = DocumentExtractionStage(
+            load_extractor(extraction['extractor']) if extraction['extractor'] else local_extractor,
+            workers=extraction['extract_workers'],
+            timeout=extraction['extract_timeout'],
+            cache_dir=extraction['extract_cache_dir']
+        )
+        return WatermelonAutomationSystem(persistence=_persistence(), rules=rules, extraction=stage)
+    env = os.environ.get
+    return ShardedAutomationSystem(shards, dict(extraction, **{
+        'db': env('WATERMELON_DB'),
+        'snapshot_dir': env('WATERMELON_SNAPSHOT_DIR'),
+        'snapshot_interval': float(env('WATERMELON_SNAPSHOT_INTERVAL', 3600)),
+        'rules': rules.path,
+        'rules_poll_interval': rules.poll_interval
+    }))
+
+system = _system()
+if system.persistence is not None:
+    # WATERMELON_WARM_START may name a snapshot; otherwise the live database is loaded
+    system.warm_start(os.environ.get('WATERMELON_WARM_START'))
+worker = WorkerState(os.environ.get('WATERMELON_WORKER_DIR'))
+
+def _admission():
+    # Under serve.py, heavy requests (running or queued) may use every thread but
+    # WATERMELON_RESERVED_THREADS, which stay free for /health and cheap reads
+    env = os.environ.get
+    threads = env('WATERMELON_THREADS')
+    capacity = max(int(threads) - int(env('WATERMELON_RESERVED_THREADS', 1)), 1) if threads else None
+    controller = AdmissionController(capacity, queue_timeout=float(env('WATERMELON_QUEUE_TIMEOUT', 2)))
+    for endpoint in ('onboarding', 'churn', 'forecast'):
+        controller.add_endpoint(
+            endpoint,
+            concurrency=int(env(f'WATERMELON_{endpoint.upper()}_CONCURRENCY', 4)),
+            queue_size=int(env(f'WATERMELON_{endpoint.upper()}_QUEUE', 16))
+        )
+    return controller
+
+admission = _admission()
+
+def admitted(endpoint):
+    # Bounded concurrency per endpoint; over the limit the client gets a fast 429/503 with Retry-After
+    # instead of a slot in an ever-growing queue
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            admitted_at, rejection = admission.acquire(endpoint)
+            if rejection is not None:
+                response = jsonify(dict(rejection, error='server busy, retry later'))
+                response.status_code = rejection['status']
+                response.headers['Retry-After'] = str(rejection['retry_after'])
+                return response
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                admission.release(endpoint, admitted_at)
+                raise
+            if getattr(response, 'is_streamed', False):
+                # A streamed response does its work while the body is sent, so it holds the slot until then
+                response.call_on_close(lambda: admission.release(endpoint, admitted_at))
+            else:
+                admission.release(endpoint, admitted_at)
+            return response
+        return wrapper
+    return decorate
+
+# X-Watermelon-Profile requests, WATERMELON_PROFILE_SAMPLE_RATE of the rest and anything slower than
+# WATERMELON_SLOW_REQUEST_MS are saved under WATERMELON_PROFILE_DIR; see GET /api/profiles
+profiler = configured_profiler()
+install_profiling(app, profiler)
+
+@app.before_request
+def track_request_start():
+    worker.request_started()
+
+@app.teardown_request
+def track_request_end(exc):
+    worker.request_finished()
+
+_closed = False
+
+def shutdown():
+    # Runs from serve.py's worker_exit hook and again from atexit; only the first call does anything.
+    # Report not-ready first, then let queued CRM/marketing/alert calls go out
+    global _closed
+    if _closed:
+        return
+    _closed = True
+    worker.mark_draining()
+    system.shutdown(drain=True)
+    worker.shutdown()
+
+atexit.register(shutdown)
+
+def _dispatcher_series(field):
+    return lambda: [({'destination': destination}, stats[field])
+                    for destination, stats in system.dispatcher.stats()['destinations'].items()]
+
+# Metrics describe this process; with sharding, stage histograms and counters stay in the shards
+REGISTRY.register_collector('watermelon_dispatch_queue_depth', 'gauge',
+                            "Side-effect payloads waiting per destination", _dispatcher_series('queue_depth'))
+REGISTRY.register_collector('watermelon_dispatch_sent_total', 'counter',
+                            "Side-effect payloads delivered per destination", _dispatcher_series('sent'))
+REGISTRY.register_collector('watermelon_dispatch_failed_total', 'counter',
+                            "Side-effect payloads dropped after retries", _dispatcher_series('failed'))
+REGISTRY.register_collector('watermelon_dispatch_flush_latency_avg_ms', 'gauge',
+                            "Average enqueue-to-delivery latency per destination",
+                            _dispatcher_series('flush_latency_avg_ms'))
+def _alert_series(field):
+    return lambda: [({}, system.alerts.stats()[field])]
+
+REGISTRY.register_collector('watermelon_inventory_alerts_suppressed_total', 'counter',
+                            "Inventory alerts dropped by the per-product dedup window", _alert_series('suppressed'))
+REGISTRY.register_collector('watermelon_inventory_alert_digests_total', 'counter',
+                            "Alert digests handed to the dispatcher", _alert_series('digests_sent'))
+
+def _cache_series(field):
+    return lambda: [({'cache': name}, stats[field]) for name, stats in system.cache_stats().items()]
+
+REGISTRY.register_collector('watermelon_cache_hits_total', 'counter', "Cache lookups served from cache",
+                            _cache_series('hits'))
+REGISTRY.register_collector('watermelon_cache_misses_total', 'counter', "Cache lookups that had to compute",
+                            _cache_series('misses'))
+REGISTRY.register_collector('watermelon_cache_entries', 'gauge', "Entries currently cached", _cache_series('size'))
+def _admission_series(field):
+    return lambda: [({'endpoint': endpoint}, stats[field])
+                    for endpoint, stats in admission.stats()['endpoints'].items()]
+
+REGISTRY.register_collector('watermelon_admission_in_flight', 'gauge',
+                            "Admitted requests running per endpoint", _admission_series('in_flight'))
+REGISTRY.register_collector('watermelon_admission_queued', 'gauge',
+                            "Requests waiting for a slot per endpoint", _admission_series('queued'))
+REGISTRY.register_collector('watermelon_admission_rejected_total', 'counter',
+                            "Requests shed by admission control per endpoint and reason",
+                            lambda: [({'endpoint': endpoint, 'reason': reason}, count)
+                                     for endpoint, stats in admission.stats()['endpoints'].items()
+                                     for reason, count in stats['rejected'].items()])
+REGISTRY.register_collector('watermelon_profiles_captured_total', 'counter',
+                            "Requests saved by the profiler: cProfile'd on request or by sampling, or too slow",
+                            lambda: [({'trigger': 'profiled'}, profiler.stats()['profiled']),
+                                     ({'trigger': 'slow'}, profiler.stats()['slow_captured'])])
+REGISTRY.register_collector('watermelon_http_in_flight', 'gauge',
+                            "Requests currently being served by this worker", lambda: [({}, worker.in_flight)])
+
+# Records per chunk in NDJSON mode: small enough that the first results go out right away
+STREAM_CHUNK_SIZE = int(os.environ.get('WATERMELON_STREAM_CHUNK_SIZE', 256))
+
+def _wants_ndjson():
+    return request.mimetype == 'application/x-ndjson'
+
+def _ndjson_records():
+    # Parsed line by line from the request body as it arrives; the full body is never buffered
+    for line in request.stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def _stream_results(pipeline):
+    # NDJSON in, NDJSON out: each chunk is scored and written back before the next is read, so memory
+    # stays flat however long the stream is. A bad record ends the stream with an error line.
+    reference_time = request.args.get('reference_time') or datetime.now().isoformat()
+
+    def generate():
+        count = 0
+        try:
+            for records in chunked(_ndjson_records(), STREAM_CHUNK_SIZE):
+                results = score_records(system, pipeline, records, reference_time)
+                count += len(results)
+                yield ''.join(json.dumps(result) + '\n' for result in results)
+        except (KeyError, TypeError, ValueError) as e:
+            yield json.dumps({'error': f"invalid record after {count} results: {e}"}) + '\n'
+        except TimeoutError as e:
+            yield json.dumps({'error': f"{e} after {count} results"}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/supplier/onboard', methods=['POST'])
+@admitted('onboarding')
 def onboard_supplier():
     data = request.json
-    result = system.process_supplier_onboarding(data)
+    # Clients may send an Idempotency-Key; otherwise identical invoice payloads are deduplicated
+    try:
+        result = system.process_supplier_onboarding(data, request.headers.get('Idempotency-Key'))
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except ValueError as e:
+        return jsonify({'error': f"invalid invoice: {e}"}), 400
+    return jsonify(result)
+
+@app.route('/api/supplier/onboard/batch', methods=['POST'])
+@admitted('onboarding')
+def onboard_supplier_batch():
+    if _wants_ndjson():
+        return _stream_results('onboarding')
+    data = request.json
+    try:
+        result = system.process_supplier_onboarding_batch(data)
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except ValueError as e:
+        return jsonify({'error': f"invalid batch: {e}"}), 400
     return jsonify(result)
 
 @app.route('/api/buyer/churn-analysis', methods=['POST'])
+@admitted('churn')
 def analyze_churn():
     data = request.json
     result = system.predict_churn_and_trigger_marketing(data)
     return jsonify(result)
 
+@app.route('/api/buyer/churn-analysis/batch', methods=['POST'])
+@admitted('churn')
+def analyze_churn_batch():
+    if _wants_ndjson():
+        return _stream_results('churn')
+    data = request.json
+    try:
+        result = system.predict_churn_batch(data)
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f"invalid batch: {e}"}), 400
+    return jsonify(result)
+
+@app.route('/api/buyer/order', methods=['POST'])
+def record_buyer_order():
+    data = request.json
+    try:
+        result = system.record_buyer_order(data)
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f"invalid order event: {e}"}), 400
+    return jsonify(result)
+
+@app.route('/api/buyer/rescore', methods=['POST'])
+@admitted('churn')
+def rescore_buyers():
+    return jsonify(system.rescore_buyers())
+
 @app.route('/api/product/demand-forecast', methods=['POST'])
+@admitted('forecast')
 def forecast_demand():
     data = request.json
     result = system.forecast_demand_and_alert(data)
     return jsonify(result)
 
+@app.route('/api/product/demand-forecast/batch', methods=['POST'])
+@admitted('forecast')
+def forecast_demand_batch():
+    if _wants_ndjson():
+        return _stream_results('forecast')
+    try:
+        results = score_records(system, 'forecast', request.json, None)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"invalid batch: {e}"}), 400
+    return jsonify({'count': len(results), 'results': results})
+
+@app.route('/api/product/sales', methods=['POST'])
+def record_sales():
+    data = request.json
+    events = data if isinstance(data, list) else [data]
+    try:
+        result = system.record_sales(events)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"invalid sales event: {e}"}), 400
+    return jsonify(result)
+
+@app.route('/api/supplier/<int:supplier_id>', methods=['GET'])
+def get_supplier(supplier_id):
+    record = system.get_supplier(supplier_id)
+    if record is None:
+        return jsonify({'error': 'supplier not found'}), 404
+    return jsonify(record)
+
+@app.route('/api/suppliers', methods=['GET'])
+def find_suppliers():
+    criteria = {field: request.args[field] for field in ('status', 'risk_level') if field in request.args}
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify(system.find_suppliers(limit=limit, **criteria))
+
+@app.route('/api/buyer/<buyer_id>', methods=['GET'])
+def get_buyer(buyer_id):
+    record = system.get_buyer(buyer_id)
+    if record is None:
+        return jsonify({'error': 'buyer not found'}), 404
+    return jsonify(record)
+
+@app.route('/api/product/<product_id>/forecast', methods=['GET'])
+def get_forecast(product_id):
+    record = system.get_forecast(product_id)
+    if record is None:
+        return jsonify({'error': 'forecast not found'}), 404
+    return jsonify(record)
+
+def _top_k():
+    return min(max(request.args.get('k', default=50, type=int), 1), 1000)
+
+@app.route('/api/buyer/top-risk', methods=['GET'])
+def top_risk_buyers():
+    k = _top_k()
+    return jsonify({'k': k, 'buyers': system.top_risk_buyers(k)})
+
+@app.route('/api/product/top-risk', methods=['GET'])
+def top_risk_products():
+    k = _top_k()
+    return jsonify({'k': k, 'products': system.top_risk_products(k)})
+
+@app.route('/api/dispatcher/stats', methods=['GET'])
+def dispatcher_stats():
+    return jsonify(system.dispatcher.stats())
+
+@app.route('/api/alerts/stats', methods=['GET'])
+def alert_stats():
+    return jsonify(system.alerts.stats())
+
+@app.route('/api/persistence/stats', methods=['GET'])
+def persistence_stats():
+    if system.persistence is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(system.persistence.stats(), enabled=True))
+
+@app.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats())
+
+@app.route('/api/extraction/stats', methods=['GET'])
+def extraction_stats():
+    return jsonify(system.extraction.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(system.cache_stats())
+
+@app.route('/api/rules', methods=['GET'])
+def rules_status():
+    return jsonify(system.rules.status())
+
+@app.route('/api/rules/reload', methods=['POST'])
+def reload_rules():
+    # Reloads this worker (and its shards) now instead of waiting for the next poll; other workers
+    # follow on theirs
+    if not system.rules.path:
+        return jsonify({'error': 'no rules file configured'}), 400
+    if not system.rules.reload():
+        return jsonify(dict(system.rules.status(), reloaded=False)), 422
+    return jsonify(dict(system.rules.status(), reloaded=True))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'timestamp': str(datetime.now())})
+    body = {
+        'status': 'healthy' if worker.ready else 'draining',
+        'timestamp': str(datetime.now()),
+        'worker': worker.snapshot(),
+        'admission': admission.stats(),
+        'workers': worker.workers()
+    }
+    return jsonify(body), 200 if worker.ready else 503
+
+worker.mark_ready()
 
 if __name__ == '__main__':
+    # Development server; use serve.py for production
     app.run(host='0.0.0.0', port=5000, debug=True)
 
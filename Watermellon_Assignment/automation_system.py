@@ -1,11 +1,26 @@
+import heapq
 import json
 import time
 import random
+import threading
+from functools import wraps
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
 from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+
+from alerting import AlertAggregator
+from caching import TTLCache, content_hash
+from dispatcher import SideEffectDispatcher
+from extraction import DocumentExtractionStage, decode_document
+from metrics import REGISTRY
+from persistence import SQLitePersistence
+from priority_index import TopKIndex
+from record_store import ColumnarStore, to_epoch_seconds
+from rules import CompiledRules, RulesEngine
+
 class AutomationStatus(Enum):
     PENDING = "pending"
     APPROVED = "approved"
@@ -37,13 +52,270 @@ class DemandForecast:
     risk_level: str
     alert_threshold: int
 
+SUPPLIER_SCHEMA = {
+    'name': 'str',
+    'credit_score': 'float',
+    'invoice_amount': 'float',
+    'contract_terms': 'category',
+    'risk_level': 'category',
+    'status': 'category'
+}
+
+BUYER_SCHEMA = {
+    'id': 'str',
+    'name': 'str',
+    'last_order_date': 'epoch',
+    'order_frequency': 'int',
+    'basket_size': 'float',
+    'churn_probability': 'float',
+    'risk_level': 'category',
+    'rescore_day': 'int'
+}
+
+FORECAST_SCHEMA = {
+    'product_id': 'str',
+    'predicted_demand': 'int',
+    'current_inventory': 'int',
+    'risk_level': 'category',
+    'alert_threshold': 'int'
+}
+
+# Append-only log of onboarding decisions, persisted alongside the supplier table
+DECISION_SCHEMA = {
+    'supplier_id': 'int',
+    'status': 'category',
+    'credit_score': 'float',
+    'risk_level': 'category',
+    'decided_at': 'epoch'
+}
+
+# Streaming forecaster state per product, so a restart resumes the same forecasts; seasonal factors and
+# the ring of recent period totals are stored as raw float64 bytes
+DEMAND_STATE_SCHEMA = {
+    'product_id': 'str',
+    'level': 'float',
+    'trend': 'float',
+    'seasonal': 'bytes',
+    'ring': 'bytes',
+    'ring_sum': 'float',
+    'observed': 'int',
+    'open_period': 'int',
+    'open_total': 'float',
+    'forecast': 'float'
+}
+
+def churn_probabilities(last_order_days: np.ndarray, order_frequency: np.ndarray, basket_size: np.ndarray) -> np.ndarray:
+    # Same model as WatermelonAutomationSystem._predict_churn, evaluated over whole columns
+    frequency_score = np.maximum(0, 1 - order_frequency / 30)
+    recency_score = np.minimum(last_order_days / 90, 1.0)
+    basket_score = np.maximum(0, 1 - basket_size / 1000)
+    return np.minimum(frequency_score * 0.4 + recency_score * 0.4 + basket_score * 0.2, 1.0)
+
+def synchronized(method):
+    # Serializes access to the shared stores and indexes; the API serves requests from many threads
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class DemandForecastEngine:
+    # Streaming additive Holt-Winters forecaster. Sales are summed into fixed-length periods;
+    # closing a period updates level/trend/seasonality and the precomputed forecast in O(1). The
+    # forecast is demand per period averaged over the next `horizon` periods, the same scale as the
+    # historical_avg fallback.
+    def __init__(self, period_seconds: int = 86400, season_length: int = 7, window: int = 28,
+                 horizon: int = 7, alpha: float = 0.3, beta: float = 0.05, gamma: float = 0.2,
+                 capacity: int = 1024):
+        self.period_seconds = period_seconds
+        self.season_length = season_length
+        self.window = max(window, season_length)
+        self.horizon = horizon
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self._index: Dict[str, int] = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self._capacity = capacity
+        self._level = np.zeros(capacity)
+        self._trend = np.zeros(capacity)
+        self._seasonal = np.zeros((capacity, self.season_length))
+        self._ring = np.zeros((capacity, self.window))
+        self._ring_sum = np.zeros(capacity)
+        self._observed = np.zeros(capacity, dtype=np.int64)
+        self._open_period = np.full(capacity, -1, dtype=np.int64)
+        self._open_total = np.zeros(capacity)
+        self._forecast = np.full(capacity, np.nan)
+        self._version = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self):
+        old = (self._level, self._trend, self._seasonal, self._ring, self._ring_sum, self._observed,
+               self._open_period, self._open_total, self._forecast, self._version)
+        size = self._capacity
+        self._allocate(size * 2)
+        new = (self._level, self._trend, self._seasonal, self._ring, self._ring_sum, self._observed,
+               self._open_period, self._open_total, self._forecast, self._version)
+        for src, dst in zip(old, new):
+            dst[:size] = src
+
+    def _row(self, product_id: str) -> int:
+        idx = self._index.get(product_id)
+        if idx is None:
+            idx = len(self._index)
+            if idx == self._capacity:
+                self._grow()
+            self._index[product_id] = idx
+        return idx
+
+    def record_sale(self, product_id: str, quantity: float, timestamp: float = None):
+        idx = self._row(product_id)
+        period = int((timestamp if timestamp is not None else to_epoch_seconds(None)) // self.period_seconds)
+        if self._open_period[idx] < 0:
+            self._open_period[idx] = period
+        else:
+            self._advance(idx, period)
+        # Late events for an already closed period are folded into the open one
+        self._open_total[idx] += quantity
+
+    def advance(self, product_id: str, period: int) -> bool:
+        # Periods otherwise close only when the next sale arrives; readers call this so a product that
+        # stopped selling sees its idle periods as zero demand. True if any period was closed.
+        idx = self._index.get(product_id)
+        if idx is None or self._open_period[idx] < 0:
+            return False
+        return self._advance(idx, period)
+
+    def _advance(self, idx: int, period: int) -> bool:
+        open_period = self._open_period[idx]
+        if period <= open_period:
+            return False
+        self._close_period(idx, self._open_total[idx])
+        # Idle periods count as zero sales; beyond one window they carry no extra information, but
+        # whole seasons are what gets skipped so the season position stays in phase with the calendar
+        idle = period - open_period - 1
+        if idle > self.window:
+            idle = self.window + (idle - self.window) % self.season_length
+        for _ in range(idle):
+            self._close_period(idx, 0.0)
+        self._open_period[idx] = period
+        self._open_total[idx] = 0.0
+        return True
+
+    def _close_period(self, idx: int, total: float):
+        pos = self._observed[idx] % self.window
+        self._ring_sum[idx] += total - self._ring[idx, pos]
+        self._ring[idx, pos] = total
+
+        observed = self._observed[idx] + 1
+        self._observed[idx] = observed
+        season_pos = (observed - 1) % self.season_length
+        if observed < self.season_length:
+            # Warm-up: flat forecast from the periods seen so far
+            self._level[idx] = self._ring_sum[idx] / observed
+        elif observed == self.season_length:
+            first_season = self._ring[idx, :self.season_length]
+            self._level[idx] = first_season.mean()
+            self._seasonal[idx] = first_season - self._level[idx]
+        else:
+            level = self._level[idx]
+            trend = self._trend[idx]
+            seasonal = self._seasonal[idx, season_pos]
+            new_level = self.alpha * (total - seasonal) + (1 - self.alpha) * (level + trend)
+            self._trend[idx] = self.beta * (new_level - level) + (1 - self.beta) * trend
+            self._seasonal[idx, season_pos] = self.gamma * (total - new_level) + (1 - self.gamma) * seasonal
+            self._level[idx] = new_level
+
+        steps = np.arange(1, self.horizon + 1)
+        seasonal_ahead = self._seasonal[idx, (observed + steps - 1) % self.season_length]
+        per_period = self._level[idx] + steps * self._trend[idx] + seasonal_ahead
+        self._forecast[idx] = np.maximum(per_period, 0).mean()
+        self._version[idx] += 1
+
+    def forecast(self, product_id: str):
+        idx = self._index.get(product_id)
+        if idx is None or self._observed[idx] == 0:
+            return None
+        return int(round(self._forecast[idx]))
+
+    def export_state(self, product_ids: List[str]) -> Dict[str, Any]:
+        # Columns in DEMAND_STATE_SCHEMA layout for the given tracked products
+        rows = np.fromiter((self._index[product_id] for product_id in product_ids), dtype=np.int64,
+                           count=len(product_ids))
+        return {
+            'product_id': list(product_ids),
+            'level': self._level[rows],
+            'trend': self._trend[rows],
+            'seasonal': [values.tobytes() for values in self._seasonal[rows]],
+            'ring': [values.tobytes() for values in self._ring[rows]],
+            'ring_sum': self._ring_sum[rows],
+            'observed': self._observed[rows],
+            'open_period': self._open_period[rows],
+            'open_total': self._open_total[rows],
+            'forecast': self._forecast[rows]
+        }
+
+    def restore_state(self, state: Dict[str, Any]):
+        rows = np.array([self._row(product_id) for product_id in state['product_id']], dtype=np.int64)
+        for field in ('level', 'trend', 'ring_sum', 'observed', 'open_period', 'open_total', 'forecast'):
+            getattr(self, f"_{field}")[rows] = state[field]
+        self._seasonal[rows] = np.frombuffer(b''.join(state['seasonal'])).reshape(rows.size, self.season_length)
+        self._ring[rows] = np.frombuffer(b''.join(state['ring'])).reshape(rows.size, self.window)
+
+    def version(self, product_id: str) -> int:
+        idx = self._index.get(product_id)
+        return 0 if idx is None else int(self._version[idx])
+
+    def __len__(self):
+        return len(self._index)
+
 class WatermelonAutomationSystem:
-    def __init__(self):
-        self.suppliers = []
-        self.buyers = []
-        self.forecasts = []
+    def __init__(self, dispatcher: SideEffectDispatcher = None, persistence: SQLitePersistence = None,
+                 rules: RulesEngine = None, extraction: DocumentExtractionStage = None):
+        self.dispatcher = dispatcher or SideEffectDispatcher()
+        # Invoice documents are parsed in a process pool; the pool starts on the first document
+        self.extraction = extraction or DocumentExtractionStage()
+        # Thresholds and decision tables; a file-backed engine picks up edits without a restart
+        self.rules = rules or RulesEngine()
+        self.persistence = persistence
+        self._closed = False
+        if persistence is not None:
+            persistence.create_table('suppliers', dict(supplier_id='int', **SUPPLIER_SCHEMA), key='supplier_id',
+                                     indexed=('risk_level', 'status'))
+            persistence.create_table('buyers', BUYER_SCHEMA, key='id', indexed=('risk_level',))
+            persistence.create_table('forecasts', FORECAST_SCHEMA, key='product_id', indexed=('risk_level',))
+            persistence.create_table('demand_state', DEMAND_STATE_SCHEMA, key='product_id')
+            persistence.create_table('onboarding_decisions', DECISION_SCHEMA, indexed=('supplier_id',))
+        self.alerts = AlertAggregator(self.dispatcher)
+        self._lock = threading.RLock()
+        self.suppliers = ColumnarStore(SupplierData, SUPPLIER_SCHEMA, name_field='name',
+                                       indexed=('risk_level', 'status'))
+        self.buyers = ColumnarStore(BuyerData, BUYER_SCHEMA, key_field='id', indexed=('risk_level',))
+        self._dirty_buyers = set()
+        self._rescore_buckets: Dict[int, set] = {}
+        self._rescore_days: List[int] = []
+        # Live top-K views, updated whenever a churn score or inventory forecast is computed
+        self.buyer_risk_index = TopKIndex()
+        self.product_risk_index = TopKIndex()
+        self.forecasts = ColumnarStore(DemandForecast, FORECAST_SCHEMA, key_field='product_id',
+                                       indexed=('risk_level',))
+        self._rng = np.random.default_rng()
+        self.demand_engine = DemandForecastEngine()
+        # Onboarding results by idempotency key, kept for a day so upstream retries replay them. This is
+        # process memory, which is why the server runs one worker (serve.py) and shards route by key
+        self.onboarding_cache = TTLCache(maxsize=50000, ttl=86400)
+        # Demand forecasts per product and forecast period; entries expire when the period ends
+        self.forecast_cache = TTLCache(maxsize=100000, ttl=self.demand_engine.period_seconds)
         
-    def process_supplier_onboarding(self, invoice_data: Dict) -> Dict:
+    def process_supplier_onboarding(self, invoice_data: Dict, idempotency_key: str = None) -> Dict:
+        # A retried or duplicate invoice returns the stored result: no rescoring, no second CRM push
+        key = f"key:{idempotency_key}" if idempotency_key else content_hash(invoice_data)
+        result, replayed = self.onboarding_cache.get_or_compute(key, lambda: self._onboard_supplier(invoice_data))
+        return dict(result, idempotent_replay=replayed)
+
+    def _onboard_supplier(self, invoice_data: Dict) -> Dict:
+        rules = self.rules.current
         # OCR + NLP processing simulation
         extracted_data = self._extract_invoice_data(invoice_data)
         credit_score = self._calculate_credit_score(extracted_data)
@@ -53,74 +325,505 @@ class WatermelonAutomationSystem:
             credit_score=credit_score,
             invoice_amount=extracted_data['amount'],
             contract_terms=extracted_data['terms'],
-            risk_level=self._assess_risk(credit_score)
+            risk_level=self._assess_risk(credit_score, rules)
         )
         
-        decision = self._make_onboarding_decision(supplier)
+        decision = self._make_onboarding_decision(supplier, rules)
+        with self._lock:
+            supplier_id = self.suppliers.append({
+                'name': supplier.name,
+                'credit_score': supplier.credit_score,
+                'invoice_amount': supplier.invoice_amount,
+                'contract_terms': supplier.contract_terms,
+                'risk_level': supplier.risk_level,
+                'status': decision.value
+            })
+            self._persist_suppliers(np.array([supplier_id]))
         self._update_zoho_crm(supplier, decision)
+        REGISTRY.inc('watermelon_requests_total', pipeline='onboarding')
+        REGISTRY.inc('watermelon_onboarding_decisions_total', status=decision.value)
         
         return {
-            'supplier_id': len(self.suppliers),
+            'supplier_id': supplier_id,
             'status': decision.value,
             'credit_score': credit_score,
-            'risk_level': supplier.risk_level
+            'risk_level': supplier.risk_level,
+            'rule_version': rules.version
         }
     
+    def process_supplier_onboarding_batch(self, invoices: Dict[str, List]) -> Dict:
+        # Bulk onboarding: extraction, scoring, risk and decisioning over whole columns
+        rules = self.rules.current
+        extracted = self._extract_invoice_batch(invoices)
+        count = len(extracted['supplier_name'])
+        credit_scores = self._calculate_credit_score_batch(extracted)
+        risk_levels = self._assess_risk_batch(credit_scores, rules)
+        decisions = self._make_onboarding_decision_batch(credit_scores, risk_levels, rules)
+
+        names = extracted['supplier_name'].tolist()
+        terms = extracted['terms'].tolist()
+        scores = credit_scores.tolist()
+        risks = risk_levels.tolist()
+        statuses = decisions.tolist()
+        with self._lock:
+            first_id = self.suppliers.extend({
+                'name': names,
+                'credit_score': credit_scores,
+                'invoice_amount': extracted['amount'],
+                'contract_terms': terms,
+                'risk_level': risks,
+                'status': statuses
+            })
+            self._persist_suppliers(np.arange(first_id, first_id + count))
+
+        self._update_zoho_crm_batch(names, statuses, scores, risks)
+        REGISTRY.inc('watermelon_requests_total', count, pipeline='onboarding')
+        for status, status_count in zip(*np.unique(decisions, return_counts=True)):
+            REGISTRY.inc('watermelon_onboarding_decisions_total', int(status_count), status=str(status))
+
+        return {
+            'count': count,
+            'rule_version': rules.version,
+            'results': [
+                {'supplier_id': supplier_id, 'status': status, 'credit_score': score, 'risk_level': risk,
+                 'rule_version': rules.version}
+                for supplier_id, status, score, risk in zip(range(first_id, first_id + count), statuses, scores, risks)
+            ]
+        }
+
     def predict_churn_and_trigger_marketing(self, buyer_data: Dict) -> Dict:
+        rules = self.rules.current
         # Churn prediction model simulation
         churn_prob = self._predict_churn(buyer_data)
-        
-        buyer = BuyerData(
-            id=buyer_data['id'],
-            name=buyer_data['name'],
-            last_order_date=datetime.fromisoformat(buyer_data['last_order_date']),
-            order_frequency=buyer_data['order_frequency'],
-            basket_size=buyer_data['basket_size'],
-            churn_probability=churn_prob
-        )
-        
-        if churn_prob > 0.7:
-            self._trigger_marketing_campaign(buyer, "high_risk")
-        elif churn_prob > 0.4:
-            self._trigger_marketing_campaign(buyer, "medium_risk")
+        action = self._apply_churn_scores(
+            [buyer_data['id']],
+            [buyer_data['name']],
+            np.array([to_epoch_seconds(buyer_data['last_order_date'])]),
+            np.array([buyer_data['order_frequency']], dtype=np.float64),
+            np.array([buyer_data['basket_size']], dtype=np.float64),
+            np.array([churn_prob]),
+            rules
+        )[0]
+        REGISTRY.inc('watermelon_requests_total', pipeline='churn')
             
         return {
-            'buyer_id': buyer.id,
+            'buyer_id': buyer_data['id'],
             'churn_probability': churn_prob,
-            'action_taken': 'marketing_triggered' if churn_prob > 0.4 else 'no_action'
+            'action_taken': action,
+            'rule_version': rules.version
         }
     
+    def predict_churn_batch(self, buyers: Dict[str, List]) -> Dict:
+        # Columnar churn scoring: one reference timestamp for the whole population
+        ids = buyers['id']
+        names = buyers['name']
+        count = len(ids)
+        for column in ('name', 'last_order_date', 'order_frequency', 'basket_size'):
+            if len(buyers[column]) != count:
+                raise ValueError(f"column '{column}' has {len(buyers[column])} rows, expected {count}")
+
+        reference_time = buyers.get('reference_time') or datetime.now()
+        if isinstance(reference_time, str):
+            reference_time = datetime.fromisoformat(reference_time)
+
+        order_dates = np.array(buyers['last_order_date'], dtype='datetime64[us]')
+        order_frequency = np.asarray(buyers['order_frequency'], dtype=np.float64)
+        basket_size = np.asarray(buyers['basket_size'], dtype=np.float64)
+        # null cells arrive as NaT/NaN and would be scored, stored and acted on like real values
+        missing = {
+            'id': np.array([buyer_id is None for buyer_id in ids], dtype=bool),
+            'name': np.array([name is None for name in names], dtype=bool),
+            'last_order_date': np.isnat(order_dates),
+            'order_frequency': np.isnan(order_frequency),
+            'basket_size': np.isnan(basket_size)
+        }
+        for column, mask in missing.items():
+            if mask.any():
+                raise ValueError(f"column '{column}' has {int(mask.sum())} missing values")
+        rules = self.rules.current
+        churn_probs = self._predict_churn_batch(order_dates, order_frequency, basket_size, reference_time)
+        actions = self._apply_churn_scores(
+            ids, names, order_dates.astype(np.int64) / 1e6, order_frequency, basket_size, churn_probs, rules
+        )
+        REGISTRY.inc('watermelon_requests_total', count, pipeline='churn')
+
+        return {
+            'count': count,
+            'reference_time': reference_time.isoformat(),
+            'rule_version': rules.version,
+            'results': [
+                {'buyer_id': buyer_id, 'churn_probability': prob, 'action_taken': action,
+                 'rule_version': rules.version}
+                for buyer_id, prob, action in zip(ids, churn_probs.tolist(), actions)
+            ]
+        }
+
+    @synchronized
+    def record_buyer_order(self, event: Dict) -> Dict:
+        # Lightweight order event: update the stored features and queue the buyer for rescoring
+        buyer_id = event['id']
+        row = self.buyers.row_of(buyer_id)
+        order_date = to_epoch_seconds(event.get('order_date'))
+        if row is None:
+            values = {
+                'name': event['name'],
+                'last_order_date': order_date,
+                'order_frequency': event.get('order_frequency', 1),
+                'basket_size': event.get('basket_size', 0.0),
+                'risk_level': 'low',
+                'rescore_day': -1
+            }
+        else:
+            stored = self.buyers.get(row)
+            last_order = to_epoch_seconds(stored['last_order_date'])
+            # order_frequency is a rate (orders per 30 days), as the churn model reads it. Without one in
+            # the event, the stored rate decays over the time since the last order and this order adds
+            # one; rounded up, that settles at the buyer's 30-day order count instead of growing with
+            # lifetime orders (rounding to nearest would stall below it)
+            decay = np.exp(-max(order_date - last_order, 0.0) / (30 * 86400))
+            order_frequency = int(np.ceil(stored['order_frequency'] * decay + 1))
+            values = {
+                'last_order_date': max(order_date, last_order),
+                'order_frequency': event.get('order_frequency', order_frequency),
+                'basket_size': event.get('basket_size', stored['basket_size'])
+            }
+            if 'name' in event:
+                values['name'] = event['name']
+        row = self.buyers.upsert(buyer_id, values)
+        self._dirty_buyers.add(row)
+        # Stored as due today so a restart before the next sweep still rescores this buyer
+        self._persist('buyers', self.buyers, BUYER_SCHEMA, np.array([row]), rescore_day=[0])
+        return {'buyer_id': buyer_id, 'pending_rescore': len(self._dirty_buyers)}
+
+    @synchronized
+    def rescore_buyers(self, reference_time: datetime = None) -> Dict:
+        # Rescore only buyers with changed inputs or whose recency pushed them over a band threshold
+        reference_epoch = to_epoch_seconds(reference_time)
+        today = int(reference_epoch // 86400)
+        due = set()
+        while self._rescore_days and self._rescore_days[0] <= today:
+            due |= self._rescore_buckets.pop(heapq.heappop(self._rescore_days), set())
+        if due:
+            due_rows = np.fromiter(due, dtype=np.int64)
+            self.buyers.assign(due_rows, {'rescore_day': np.full(due_rows.size, -1)})
+        dirty = self._dirty_buyers
+        self._dirty_buyers = set()
+        rows = np.fromiter(dirty | due, dtype=np.int64)
+        rules = self.rules.current
+        if not rows.size:
+            return {'rescored': 0, 'changed_inputs': 0, 'recency_due': 0, 'marketing_triggered': 0,
+                    'rule_version': rules.version}
+
+        last_order_epoch = self.buyers.values_at('last_order_date', rows)
+        order_frequency = self.buyers.values_at('order_frequency', rows).astype(np.float64)
+        basket_size = self.buyers.values_at('basket_size', rows)
+        last_order_days = np.floor((reference_epoch - last_order_epoch) / 86400)
+        churn_probs = churn_probabilities(last_order_days, order_frequency, basket_size)
+
+        actions = self._apply_churn_scores(
+            self.buyers.values_at('id', rows).tolist(),
+            self.buyers.values_at('name', rows).tolist(),
+            last_order_epoch, order_frequency, basket_size, churn_probs, rules
+        )
+        return {
+            'rescored': int(rows.size),
+            'changed_inputs': len(dirty),
+            'recency_due': len(due),
+            'marketing_triggered': actions.count('marketing_triggered'),
+            'rule_version': rules.version
+        }
+
+    @synchronized
+    @REGISTRY.timed('forecast.sales_ingest')
+    def record_sales(self, events: List[Dict]) -> Dict:
+        # Feed sales events into the streaming forecaster; each event is an O(1) update
+        for event in events:
+            self.demand_engine.record_sale(
+                event['product_id'],
+                float(event['quantity']),
+                to_epoch_seconds(event.get('timestamp'))
+            )
+        self._persist_demand_state(list(dict.fromkeys(event['product_id'] for event in events)))
+        return {'events_recorded': len(events), 'products_tracked': len(self.demand_engine)}
+
+    @synchronized
     def forecast_demand_and_alert(self, product_data: Dict) -> Dict:
-        # Demand forecasting simulation
-        predicted_demand = self._forecast_demand(product_data)
+        rules = self.rules.current
+        product_id = product_data['product_id']
+        now = to_epoch_seconds(None)
+        period_seconds = self.demand_engine.period_seconds
+        period = int(now // period_seconds)
+        if self.demand_engine.advance(product_id, period):
+            self._persist_demand_state([product_id])
+        # New sales history bumps the engine version, so a stale forecast is never looked up; the alert
+        # threshold depends on the rules, so a reload does the same
+        key = (product_id, period, self.demand_engine.version(product_id), product_data.get('historical_avg'),
+               rules.version)
+        entry = self.forecast_cache.get(key)
+        cached = entry is not None
+        if not cached:
+            # Precomputed streaming forecast when the product has sales history, simulation otherwise
+            predicted_demand = self.demand_engine.forecast(product_id)
+            forecast_source = 'streaming'
+            if predicted_demand is None:
+                predicted_demand = self._forecast_demand(product_data)
+                forecast_source = 'historical_avg'
+            entry = (predicted_demand, forecast_source,
+                     int(predicted_demand * rules.param('alert_threshold_factor')))
+            self.forecast_cache.put(key, entry, ttl=(period + 1) * period_seconds - now)
+        predicted_demand, forecast_source, alert_threshold = entry
+
+        # Only the inventory-dependent part is evaluated on every call
         current_inventory = product_data['current_inventory']
-        
         forecast = DemandForecast(
-            product_id=product_data['product_id'],
+            product_id=product_id,
             predicted_demand=predicted_demand,
             current_inventory=current_inventory,
-            risk_level=self._assess_inventory_risk(predicted_demand, current_inventory),
-            alert_threshold=int(predicted_demand * 0.8)
+            risk_level=self._assess_inventory_risk(predicted_demand, current_inventory, rules),
+            alert_threshold=alert_threshold
+        )
+        
+        row = self.forecasts.upsert(forecast.product_id, {
+            'predicted_demand': forecast.predicted_demand,
+            'current_inventory': forecast.current_inventory,
+            'risk_level': forecast.risk_level,
+            'alert_threshold': forecast.alert_threshold
+        })
+        self._persist('forecasts', self.forecasts, FORECAST_SCHEMA, np.array([row]))
+        
+        # Lowest inventory/demand ratio ranks first
+        self.product_risk_index.update(
+            forecast.product_id, -(current_inventory / predicted_demand if predicted_demand > 0 else 1)
         )
         
+        alert_status = None
         if current_inventory < forecast.alert_threshold:
-            self._send_inventory_alert(forecast)
+            alert_status = self._send_inventory_alert(forecast)
+        else:
+            self.alerts.resolve(forecast.product_id)
+        REGISTRY.inc('watermelon_requests_total', pipeline='forecast')
             
         return {
             'product_id': forecast.product_id,
             'predicted_demand': predicted_demand,
             'inventory_risk': forecast.risk_level,
-            'alert_sent': current_inventory < forecast.alert_threshold
+            'alert_sent': alert_status in ('queued', 'escalated'),
+            'alert_status': alert_status,
+            'forecast_source': forecast_source,
+            'cached': cached,
+            'rule_version': rules.version
         }
     
+    def flush(self, timeout: float = None) -> bool:
+        # Push out pending alert digests, then wait for every queued side effect to be delivered
+        self.alerts.flush()
+        if self.persistence is not None:
+            self.persistence.flush(timeout)
+        return self.dispatcher.flush(timeout)
+
+    def shutdown(self, drain: bool = True, timeout: float = 10.0):
+        if self._closed:
+            return
+        self._closed = True
+        self.rules.stop()
+        self.extraction.shutdown()
+        self.alerts.stop()
+        self.dispatcher.stop(drain, timeout)
+        if self.persistence is not None:
+            self.persistence.close(timeout)
+
+    @synchronized
+    def warm_start(self, source: str = None) -> Dict:
+        # Rebuild the working set from the database, or from a snapshot file given as source
+        started = time.perf_counter()
+        suppliers = self.persistence.load('suppliers', source)
+        # Supplier ids are row ids: each row goes back under its stored id, and an id missing from the
+        # table stays an empty row rather than shifting every later supplier onto the wrong id
+        supplier_ids = suppliers.pop('supplier_id')
+        self.suppliers.extend_at(supplier_ids, self._loaded_columns(SUPPLIER_SCHEMA, suppliers))
+
+        buyers = self._loaded_columns(BUYER_SCHEMA, self.persistence.load('buyers', source))
+        if buyers['id']:
+            first = self.buyers.extend(buyers)
+            rows = np.arange(first, first + len(buyers['id']))
+            self.buyer_risk_index.update_many(buyers['id'], buyers['churn_probability'].tolist())
+            self._restore_rescore_schedule(rows, buyers['rescore_day'])
+
+        forecasts = self._loaded_columns(FORECAST_SCHEMA, self.persistence.load('forecasts', source))
+        if forecasts['product_id']:
+            self.forecasts.extend(forecasts)
+            demand = forecasts['predicted_demand']
+            ratios = np.where(demand > 0, forecasts['current_inventory'] / np.maximum(demand, 1), 1.0)
+            self.product_risk_index.update_many(forecasts['product_id'], (-ratios).tolist())
+
+        demand = self._loaded_columns(DEMAND_STATE_SCHEMA, self.persistence.load('demand_state', source))
+        if demand['product_id']:
+            self.demand_engine.restore_state(demand)
+
+        return {
+            'suppliers': len(self.suppliers),
+            'buyers': len(self.buyers),
+            'forecasts': len(self.forecasts),
+            'demand_products': len(demand['product_id']),
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+
+    def _loaded_columns(self, schema: Dict[str, str], columns: Dict[str, List]) -> Dict:
+        return {
+            field: np.asarray(values, dtype=np.float64 if schema[field] != 'int' else np.int64)
+            if schema[field] in ('float', 'int', 'epoch') else values
+            for field, values in columns.items()
+        }
+
+    def _restore_rescore_schedule(self, rows: np.ndarray, rescore_days: np.ndarray):
+        scheduled = np.flatnonzero(rescore_days >= 0)
+        order = scheduled[np.argsort(rescore_days[scheduled], kind='stable')]
+        days, starts = np.unique(rescore_days[order], return_index=True)
+        for day, members in zip(days.tolist(), np.split(rows[order], starts[1:])):
+            self._rescore_buckets.setdefault(day, set()).update(members.tolist())
+        self._rescore_days = list(self._rescore_buckets)
+        heapq.heapify(self._rescore_days)
+
+    def _persist(self, table: str, store: ColumnarStore, schema: Dict[str, str], rows: np.ndarray, **overrides):
+        # Hands decoded copies of the rows to the background writer; nothing blocks on disk here
+        if self.persistence is None:
+            return
+        columns = self._export_rows(store, schema, rows)
+        columns.update(overrides)
+        self.persistence.write(table, columns)
+
+    def _export_rows(self, store: ColumnarStore, schema: Dict[str, str], rows: np.ndarray) -> Dict:
+        if rows.size == 1:
+            # Per-request writes: a plain dict lookup beats building one array per field
+            return {field: [value] for field, value in store.row_values(int(rows[0])).items()}
+        return {field: store.values_at(field, rows) for field in schema}
+
+    def _persist_demand_state(self, product_ids: List[str]):
+        if self.persistence is None or not product_ids:
+            return
+        self.persistence.write('demand_state', self.demand_engine.export_state(product_ids))
+
+    def _persist_suppliers(self, rows: np.ndarray):
+        if self.persistence is None:
+            return
+        columns = self._export_rows(self.suppliers, SUPPLIER_SCHEMA, rows)
+        columns['supplier_id'] = rows
+        self.persistence.write('suppliers', columns)
+        self.persistence.write('onboarding_decisions', {
+            'supplier_id': rows,
+            'status': columns['status'],
+            'credit_score': columns['credit_score'],
+            'risk_level': columns['risk_level'],
+            'decided_at': np.full(rows.size, to_epoch_seconds(None))
+        })
+
+    def cache_stats(self) -> Dict:
+        return {'onboarding': self.onboarding_cache.stats(), 'forecast': self.forecast_cache.stats()}
+
+    @synchronized
+    def get_supplier(self, supplier_id: int) -> Dict:
+        record = self.suppliers.get(supplier_id)
+        if record is None or record['name'] is None:
+            # Out of range, or an id whose row never reached the database (see warm_start)
+            return None
+        return dict(record, supplier_id=supplier_id)
+
+    @synchronized
+    def find_suppliers(self, limit: int = 100, **criteria) -> Dict:
+        # e.g. find_suppliers(status='needs_review') -> served from the secondary index
+        supplier_ids = self.suppliers.rows_where(**criteria)
+        if not criteria:
+            # Only an unfiltered listing includes empty rows; they are in no index
+            names = self.suppliers.values_at('name', np.asarray(supplier_ids, dtype=np.int64)).tolist()
+            supplier_ids = [row for row, name in zip(supplier_ids, names) if name is not None]
+        return {
+            'count': len(supplier_ids),
+            'suppliers': [self.get_supplier(supplier_id) for supplier_id in supplier_ids[:limit]]
+        }
+
+    @synchronized
+    def get_buyer(self, buyer_id: str) -> Dict:
+        row = self.buyers.row_of(buyer_id)
+        if row is None:
+            return None
+        record = self.buyers.get(row)
+        record['last_order_date'] = record['last_order_date'].isoformat()
+        return record
+
+    @synchronized
+    def get_forecast(self, product_id: str) -> Dict:
+        row = self.forecasts.row_of(product_id)
+        return None if row is None else self.forecasts.get(row)
+
+    @synchronized
+    def top_risk_buyers(self, k: int = 50) -> List[Dict]:
+        # Complete only for what this process has scored; the API runs a single worker for that reason
+        top = self.buyer_risk_index.top(k)
+        rows = self.buyers.rows_of([buyer_id for buyer_id, _ in top])
+        return [
+            {'buyer_id': buyer_id, 'name': name, 'churn_probability': prob, 'risk_level': risk}
+            for (buyer_id, prob), name, risk in zip(
+                top, self.buyers.values_at('name', rows).tolist(), self.buyers.values_at('risk_level', rows).tolist()
+            )
+        ]
+
+    @synchronized
+    def top_risk_products(self, k: int = 50) -> List[Dict]:
+        results = []
+        for product_id, score in self.product_risk_index.top(k):
+            record = self.forecasts.get(self.forecasts.row_of(product_id))
+            results.append({
+                'product_id': product_id,
+                'inventory_ratio': -score,
+                'predicted_demand': record['predicted_demand'],
+                'current_inventory': record['current_inventory'],
+                'risk_level': record['risk_level']
+            })
+        return results
+
+    @REGISTRY.timed('onboarding.extract')
     def _extract_invoice_data(self, invoice_data: Dict) -> Dict:
-        # Simulate OCR + NLP extraction
+        # Fields sent explicitly win over fields parsed from an attached invoice document
+        if invoice_data.get('document') is not None:
+            parsed = self.extraction.extract(decode_document(invoice_data['document']))
+            invoice_data = dict(parsed, **{field: value for field, value in invoice_data.items() if value is not None})
         return {
             'supplier_name': invoice_data.get('supplier_name', f"Supplier_{random.randint(1000, 9999)}"),
             'amount': invoice_data.get('amount', random.uniform(5000, 50000)),
             'terms': invoice_data.get('terms', 'NET30')
         }
     
+    @REGISTRY.timed('onboarding.extract_batch')
+    def _extract_invoice_batch(self, invoices: Dict[str, List]) -> Dict[str, np.ndarray]:
+        # Columnar counterpart of _extract_invoice_data; missing columns or cells get the same defaults
+        count = max((len(column) for column in invoices.values()), default=0)
+        for column, values in invoices.items():
+            if len(values) != count:
+                raise ValueError(f"column '{column}' has {len(values)} rows, expected {count}")
+
+        names = invoices.get('supplier_name') or [None] * count
+        amounts = invoices.get('amount') or [None] * count
+        terms = invoices.get('terms') or [None] * count
+        documents = invoices.get('document') or [None] * count
+        with_document = [row for row, document in enumerate(documents) if document is not None]
+        if with_document:
+            parsed = self.extraction.extract_many([decode_document(documents[row]) for row in with_document])
+            names, amounts, terms = list(names), list(amounts), list(terms)
+            for row, fields in zip(with_document, parsed):
+                names[row] = names[row] if names[row] is not None else fields.get('supplier_name')
+                amounts[row] = amounts[row] if amounts[row] is not None else fields.get('amount')
+                terms[row] = terms[row] if terms[row] is not None else fields.get('terms')
+        return {
+            'supplier_name': np.array([
+                name if name is not None else f"Supplier_{random.randint(1000, 9999)}" for name in names
+            ]),
+            'amount': np.array([
+                amount if amount is not None else random.uniform(5000, 50000) for amount in amounts
+            ], dtype=np.float64),
+            'terms': np.array([term if term is not None else 'NET30' for term in terms])
+        }
+
+    @REGISTRY.timed('onboarding.credit_score')
     def _calculate_credit_score(self, data: Dict) -> float:
         # Credit scoring logic simulation
         base_score = 650
@@ -128,19 +831,33 @@ class WatermelonAutomationSystem:
         terms_factor = 30 if data['terms'] == 'NET30' else 0
         return min(base_score + amount_factor + terms_factor + random.uniform(-50, 50), 850)
     
-    def _assess_risk(self, credit_score: float) -> str:
-        if credit_score >= 750: return "low"
-        elif credit_score >= 650: return "medium"
-        else: return "high"
+    @REGISTRY.timed('onboarding.risk')
+    def _assess_risk(self, credit_score: float, rules: CompiledRules) -> str:
+        return rules['supplier_risk'](credit_score)
     
-    def _make_onboarding_decision(self, supplier: SupplierData) -> AutomationStatus:
-        if supplier.credit_score >= 750 and supplier.risk_level == "low":
-            return AutomationStatus.APPROVED
-        elif supplier.credit_score < 600:
-            return AutomationStatus.REJECTED
-        else:
-            return AutomationStatus.NEEDS_REVIEW
+    @REGISTRY.timed('onboarding.decision')
+    def _make_onboarding_decision(self, supplier: SupplierData, rules: CompiledRules) -> AutomationStatus:
+        return AutomationStatus(rules['onboarding_decision'](
+            credit_score=supplier.credit_score, risk_level=supplier.risk_level
+        ))
     
+    @REGISTRY.timed('onboarding.credit_score_batch')
+    def _calculate_credit_score_batch(self, data: Dict[str, np.ndarray]) -> np.ndarray:
+        amount_factor = np.minimum(data['amount'] / 10000, 2.0) * 50
+        terms_factor = np.where(data['terms'] == 'NET30', 30, 0)
+        jitter = self._rng.uniform(-50, 50, len(data['amount']))
+        return np.minimum(650 + amount_factor + terms_factor + jitter, 850)
+
+    @REGISTRY.timed('onboarding.risk_batch')
+    def _assess_risk_batch(self, credit_scores: np.ndarray, rules: CompiledRules) -> np.ndarray:
+        return rules['supplier_risk'](credit_scores)
+
+    @REGISTRY.timed('onboarding.decision_batch')
+    def _make_onboarding_decision_batch(self, credit_scores: np.ndarray, risk_levels: np.ndarray,
+                                        rules: CompiledRules) -> np.ndarray:
+        return rules['onboarding_decision'](credit_score=credit_scores, risk_level=risk_levels)
+
+    @REGISTRY.timed('churn.predict')
     def _predict_churn(self, buyer_data: Dict) -> float:
         # Churn prediction model simulation
         last_order_days = (datetime.now() - datetime.fromisoformat(buyer_data['last_order_date'])).days
@@ -150,6 +867,84 @@ class WatermelonAutomationSystem:
         
         return min((frequency_score * 0.4 + recency_score * 0.4 + basket_score * 0.2), 1.0)
     
+    @REGISTRY.timed('churn.predict_batch')
+    def _predict_churn_batch(self, order_dates: np.ndarray, order_frequency: np.ndarray,
+                             basket_size: np.ndarray, reference_time: datetime) -> np.ndarray:
+        last_order_days = (np.datetime64(reference_time, 'us') - order_dates) // np.timedelta64(1, 'D')
+        return churn_probabilities(last_order_days, order_frequency, basket_size)
+
+    @synchronized
+    @REGISTRY.timed('churn.apply')
+    def _apply_churn_scores(self, ids: List[str], names: List[str], last_order_epoch: np.ndarray,
+                            order_frequency: np.ndarray, basket_size: np.ndarray,
+                            churn_probs: np.ndarray, rules: CompiledRules) -> List[str]:
+        # Store the scores and trigger marketing only for buyers whose risk band actually changed
+        previous = self.buyers.values_at('risk_level', self.buyers.rows_of(ids))
+        risk_levels = rules['churn_risk'](churn_probs)
+        rows = np.asarray(self.buyers.upsert_many({
+            'name': names,
+            'last_order_date': last_order_epoch,
+            'order_frequency': order_frequency,
+            'basket_size': basket_size,
+            'churn_probability': churn_probs,
+            'risk_level': risk_levels.tolist()
+        }, keys=ids), dtype=np.int64)
+        self._dirty_buyers.difference_update(rows.tolist())
+        self.buyer_risk_index.update_many(ids, churn_probs.tolist())
+        self._schedule_rescore(rows, last_order_epoch, order_frequency, basket_size, churn_probs, rules)
+        self._persist('buyers', self.buyers, BUYER_SCHEMA, rows)
+
+        triggered = (risk_levels != previous) & (risk_levels != "low")
+        triggered_idx = np.flatnonzero(triggered).tolist()
+        self._trigger_marketing_campaign_batch(
+            [ids[idx] for idx in triggered_idx],
+            [names[idx] for idx in triggered_idx],
+            np.where(risk_levels[triggered_idx] == "high", "high_risk", "medium_risk").tolist(),
+            churn_probs[triggered_idx].tolist()
+        )
+        return np.select(
+            [triggered, risk_levels != "low"], ['marketing_triggered', 'already_targeted'], 'no_action'
+        ).tolist()
+
+    @REGISTRY.timed('churn.schedule_rescore')
+    def _schedule_rescore(self, rows: np.ndarray, last_order_epoch: np.ndarray, order_frequency: np.ndarray,
+                          basket_size: np.ndarray, churn_probs: np.ndarray, rules: CompiledRules):
+        # With frozen inputs churn only grows with recency, so each buyer has a known day on which it
+        # crosses into the next band. Buyers are bucketed by that day; the sweep pops due buckets only.
+        bands = rules['churn_risk']
+        band = bands.codes(churn_probs)
+        thresholds = bands.next_edge(churn_probs)
+        crossed = lambda days: bands.codes(churn_probabilities(days, order_frequency, basket_size)) > band
+        base = churn_probabilities(np.zeros(len(rows)), order_frequency, basket_size)
+        with np.errstate(invalid='ignore'):
+            days = np.nan_to_num(np.maximum(np.floor(90 * (thresholds - base) / 0.4) + 1, 0))
+            # Guard against float rounding on the boundary day
+            earlier = np.maximum(days - 1, 0)
+            days = np.where(crossed(earlier), earlier, days)
+            days = np.where(crossed(days), days, days + 1)
+            reachable = crossed(np.full(len(rows), 90.0))
+        # First day whose every moment is at least `days` whole days after the last order, matching the
+        # floor((reference - last_order) / 86400) recency of rescore_buyers wherever in the day it runs
+        due_epoch = last_order_epoch + days * 86400
+        rescore_days = np.where(reachable, np.ceil(due_epoch / 86400), -1).astype(np.int64)
+
+        previous = self.buyers.values_at('rescore_day', rows)
+        moved = np.flatnonzero(previous != rescore_days)
+        for idx in moved.tolist():
+            row = int(rows[idx])
+            old_day = int(previous[idx])
+            if old_day >= 0 and old_day in self._rescore_buckets:
+                self._rescore_buckets[old_day].discard(row)
+            new_day = int(rescore_days[idx])
+            if new_day >= 0:
+                bucket = self._rescore_buckets.get(new_day)
+                if bucket is None:
+                    bucket = self._rescore_buckets[new_day] = set()
+                    heapq.heappush(self._rescore_days, new_day)
+                bucket.add(row)
+        self.buyers.assign(rows[moved], {'rescore_day': rescore_days[moved]})
+
+    @REGISTRY.timed('forecast.predict')
     def _forecast_demand(self, product_data: Dict) -> int:
         # Demand forecasting simulation
         base_demand = product_data.get('historical_avg', 100)
@@ -158,24 +953,49 @@ class WatermelonAutomationSystem:
         
         return int(base_demand * seasonal_factor * trend_factor)
     
-    def _assess_inventory_risk(self, predicted_demand: int, current_inventory: int) -> str:
+    @REGISTRY.timed('forecast.inventory_risk')
+    def _assess_inventory_risk(self, predicted_demand: int, current_inventory: int, rules: CompiledRules) -> str:
         ratio = current_inventory / predicted_demand if predicted_demand > 0 else 1
-        if ratio < 0.5: return "critical"
-        elif ratio < 0.8: return "high"
-        else: return "normal"
+        return rules['inventory_risk'](ratio)
     
+    @REGISTRY.timed('onboarding.crm_push')
     def _update_zoho_crm(self, supplier: SupplierData, decision: AutomationStatus):
-        # Simulate Zoho CRM API call
-        print(f"Zoho CRM Update: {supplier.name} -> {decision.value}")
-    
-    def _trigger_marketing_campaign(self, buyer: BuyerData, risk_level: str):
-        # Simulate marketing automation
-        if risk_level == "high_risk":
-            print(f"Marketing: Discount email + WhatsApp nudge for {buyer.name}")
-        else:
-            print(f"Marketing: Follow-up task created for {buyer.name}")
+        # Queued for the background dispatcher; the Zoho CRM call happens off the request path
+        self.dispatcher.submit('crm', {
+            'supplier_name': supplier.name,
+            'status': decision.value,
+            'credit_score': supplier.credit_score,
+            'risk_level': supplier.risk_level
+        })
     
-    def _send_inventory_alert(self, forecast: DemandForecast):
-        # Simulate alert system
-        print(f"Inventory Alert: {forecast.product_id} - Risk: {forecast.risk_level}")
+    @REGISTRY.timed('onboarding.crm_push_batch')
+    def _update_zoho_crm_batch(self, names: List[str], statuses: List[str], scores: List[float], risks: List[str]):
+        self.dispatcher.submit_many('crm', [
+            {'supplier_name': name, 'status': status, 'credit_score': score, 'risk_level': risk}
+            for name, status, score, risk in zip(names, statuses, scores, risks)
+        ])
 
+    @REGISTRY.timed('churn.marketing_batch')
+    def _trigger_marketing_campaign_batch(self, ids: List[str], names: List[str], risk_levels: List[str],
+                                          churn_probs: List[float]):
+        if ids:
+            REGISTRY.inc('watermelon_alerts_total', len(ids), type='marketing')
+        self.dispatcher.submit_many('marketing', [
+            {'buyer_id': buyer_id, 'buyer_name': name, 'risk_level': risk_level, 'churn_probability': prob}
+            for buyer_id, name, risk_level, prob in zip(ids, names, risk_levels, churn_probs)
+        ])
+    
+    @REGISTRY.timed('forecast.alert')
+    def _send_inventory_alert(self, forecast: DemandForecast) -> str:
+        # Deduplicated and escalated by the aggregator, then delivered in periodic digests; suppressed
+        # alerts are not counted
+        status = self.alerts.offer({
+            'product_id': forecast.product_id,
+            'risk_level': forecast.risk_level,
+            'predicted_demand': forecast.predicted_demand,
+            'current_inventory': forecast.current_inventory,
+            'alert_threshold': forecast.alert_threshold
+        })
+        if status in ('queued', 'escalated'):
+            REGISTRY.inc('watermelon_alerts_total', type='inventory')
+        return status
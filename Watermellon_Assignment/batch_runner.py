@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+from automation_system import WatermelonAutomationSystem
+from dispatcher import ConsoleTransport, InMemoryTransport, SideEffectDispatcher
+from extraction import DocumentExtractionStage
+
+PIPELINES = ('onboarding', 'churn', 'forecast')
+
+# CSV cells arrive as text; these fields are converted before scoring
+NUMERIC_FIELDS = {
+    'onboarding': {'amount': float},
+    'churn': {'order_frequency': int, 'basket_size': float},
+    'forecast': {'current_inventory': int, 'historical_avg': float}
+}
+
+_dispatcher = None
+_extraction = None
+
+def read_records(path: str, pipeline: str) -> Iterator[Dict]:
+    # Streams one record at a time so memory does not depend on file size
+    with open(path, newline='', encoding='utf-8') as handle:
+        if path.endswith('.csv'):
+            converters = NUMERIC_FIELDS[pipeline]
+            for row in csv.DictReader(handle):
+                for field, value in row.items():
+                    if value == '':
+                        row[field] = None
+                    elif field in converters:
+                        row[field] = converters[field](value)
+                yield row
+        else:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def chunked(records: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _init_worker(side_effects: str):
+    # Only the side-effect queues and the document pool live for the whole run; scoring state does not
+    global _dispatcher, _extraction
+    transport = ConsoleTransport() if side_effects == 'console' else InMemoryTransport(max_batches=0)
+    _dispatcher = SideEffectDispatcher(transport)
+    _extraction = DocumentExtractionStage()
+
+def _columns(records: List[Dict], required: Iterable[str] = (), optional: Iterable[str] = ()) -> Dict[str, List]:
+    # A record without a required field raises KeyError, which ends a stream with its error line
+    columns = {field: [record[field] for record in records] for field in required}
+    columns.update({field: [record.get(field) for record in records] for field in optional})
+    return columns
+
+def score_records(system: WatermelonAutomationSystem, pipeline: str, records: List[Dict],
+                  reference_time: str) -> List[Dict]:
+    # One chunk of row records through the columnar batch path; shared with the API's NDJSON mode
+    if pipeline == 'onboarding':
+        return system.process_supplier_onboarding_batch(
+            _columns(records, optional=('supplier_name', 'amount', 'terms', 'document'))
+        )['results']
+    if pipeline == 'churn':
+        buyers = _columns(records, required=('id', 'name', 'last_order_date', 'order_frequency', 'basket_size'))
+        buyers['reference_time'] = reference_time
+        return system.predict_churn_batch(buyers)['results']
+    return [system.forecast_demand_and_alert(record) for record in records]
+
+def process_chunk(pipeline: str, records: List[Dict], reference_time: str) -> List[Dict]:
+    # A fresh system per chunk: the stores, top-K indexes, rescore buckets and caches a long-lived one
+    # accumulates are dropped with it, so worker memory stays flat however long the file is
+    system = WatermelonAutomationSystem(_dispatcher, extraction=_extraction)
+    try:
+        return score_records(system, pipeline, records, reference_time)
+    finally:
+        system.alerts.stop()
+        system.flush()
+
+def run(pipeline: str, input_path: str, output_path: str, chunk_size: int, workers: int,
+        side_effects: str, progress_every: float) -> Dict:
+    reference_time = datetime.now().isoformat()
+    chunks = chunked(read_records(input_path, pipeline), chunk_size)
+    rows = 0
+    started = last_report = time.perf_counter()
+
+    def report(final: bool = False):
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed else 0.0
+        label = 'done' if final else 'progress'
+        print(f"[{label}] {rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec)", file=sys.stderr)
+
+    with open(output_path, 'w', encoding='utf-8') as out:
+        def write(results: List[Dict]):
+            nonlocal rows, last_report
+            out.writelines(json.dumps(result) + '\n' for result in results)
+            rows += len(results)
+            if time.perf_counter() - last_report >= progress_every:
+                last_report = time.perf_counter()
+                report()
+
+        if workers <= 0:
+            _init_worker(side_effects)
+            for chunk in chunks:
+                write(process_chunk(pipeline, chunk, reference_time))
+        else:
+            # At most two chunks per worker are in flight; results are written in input order
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(side_effects,)) as pool:
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append(pool.submit(process_chunk, pipeline, chunk, reference_time))
+                    if len(in_flight) >= workers * 2:
+                        write(in_flight.popleft().result())
+                while in_flight:
+                    write(in_flight.popleft().result())
+
+    report(final=True)
+    elapsed = time.perf_counter() - started
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_sec': rows / elapsed if elapsed else 0.0}
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run an automation pipeline over a JSONL or CSV export")
+    parser.add_argument('pipeline', choices=PIPELINES)
+    parser.add_argument('input', help="input file (.jsonl or .csv)")
+    parser.add_argument('output', help="output file, one JSON result per line")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes; 0 runs everything in this process")
+    parser.add_argument('--side-effects', choices=('none', 'console'), default='none',
+                        help="'console' prints CRM/marketing/alert calls, 'none' discards them")
+    parser.add_argument('--progress-every', type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    run(args.pipeline, args.input, args.output, args.chunk_size, args.workers,
+        args.side_effects, args.progress_every)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+from urllib.parse import urlparse
+
+import numpy as np
+
+from automation_system import WatermelonAutomationSystem
+from batch_runner import chunked
+from demo import ProductionDemo
+from dispatcher import InMemoryTransport, SideEffectDispatcher
+from extraction import DocumentExtractionStage
+
+# Fixed reference date so generated buyers, and therefore churn results, are reproducible
+BASE_DATE = datetime(2025, 1, 1)
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(int(np.ceil(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+def summarize(records: int, elapsed: float, latencies: List[float]) -> Dict:
+    latencies = sorted(latencies)
+    return {
+        'records': records,
+        'seconds': round(elapsed, 4),
+        'throughput_per_sec': round(records / elapsed, 1) if elapsed else 0.0,
+        'calls': len(latencies),
+        'p50_ms': round(1000 * percentile(latencies, 50), 4),
+        'p95_ms': round(1000 * percentile(latencies, 95), 4),
+        'p99_ms': round(1000 * percentile(latencies, 99), 4)
+    }
+
+def timed_calls(call: Callable, items: Iterable, size_of: Callable = lambda item: 1) -> Dict:
+    latencies = []
+    records = 0
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        call(item)
+        latencies.append(time.perf_counter() - t0)
+        records += size_of(item)
+    return summarize(records, time.perf_counter() - started, latencies)
+
+def columns(records: List[Dict], fields: Iterable[str]) -> Dict[str, List]:
+    return {field: [record[field] for record in records] for field in fields}
+
+class Benchmark:
+    def __init__(self, records: int, single_records: int, http_records: int, chunk_size: int,
+                 seed: int, url: str = None, documents: int = 200):
+        self.records = records
+        self.documents = documents
+        self.single_records = min(single_records, records)
+        self.http_records = min(http_records, records)
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.url = url
+        self.demo = ProductionDemo()
+
+    def _system(self) -> WatermelonAutomationSystem:
+        # Side effects are recorded in memory so the benchmark measures the pipelines, not stdout
+        return WatermelonAutomationSystem(SideEffectDispatcher(InMemoryTransport(max_batches=0)))
+
+    def suppliers(self, count: int):
+        return self.demo.iter_mock_suppliers(count, self.seed)
+
+    def buyers(self, count: int):
+        return self.demo.iter_mock_buyers(count, self.seed, BASE_DATE)
+
+    def products(self, count: int):
+        return self.demo.iter_mock_products(count, self.seed)
+
+    def invoice_documents(self, count: int):
+        # Text layer up front, then ~64 KB of seeded "scan" bytes for the extractor to chew on
+        rng = np.random.default_rng(self.seed)
+        for supplier in self.suppliers(count):
+            header = (f"INVOICE\nSupplier: {supplier['supplier_name']}\nTotal: {supplier['amount']:.2f}\n"
+                      f"Payment Terms: {supplier.get('terms') or 'NET30'}\n").encode()
+            yield header + rng.integers(0, 256, 65536, dtype=np.uint8).tobytes()
+
+    def run_in_process(self) -> Dict:
+        results = {}
+        system = self._system()
+        results['onboarding.single'] = timed_calls(
+            system.process_supplier_onboarding, self.suppliers(self.single_records))
+        results['onboarding.batch'] = timed_calls(
+            lambda chunk: system.process_supplier_onboarding_batch(
+                columns(chunk, ('supplier_name', 'amount', 'terms'))),
+            chunked(self.suppliers(self.records), self.chunk_size), len)
+
+        results['churn.single'] = timed_calls(
+            system.predict_churn_and_trigger_marketing, self.buyers(self.single_records))
+        reference_time = BASE_DATE.isoformat()
+        results['churn.batch'] = timed_calls(
+            lambda chunk: system.predict_churn_batch(dict(
+                columns(chunk, ('id', 'name', 'last_order_date', 'order_frequency', 'basket_size')),
+                reference_time=reference_time)),
+            chunked(self.buyers(self.records), self.chunk_size), len)
+
+        results['forecast.single'] = timed_calls(
+            system.forecast_demand_and_alert, self.products(self.single_records))
+        sales = ({'product_id': product['product_id'], 'quantity': product['historical_avg'],
+                  'timestamp': day * 86400}
+                 for day in range(14) for product in self.products(self.single_records // 14 or 1))
+        results['forecast.sales_ingest'] = timed_calls(system.record_sales, chunked(sales, self.chunk_size), len)
+        system.shutdown(drain=False)
+
+        # Cold cache, so every document goes through the extraction pool
+        cache_dir = tempfile.mkdtemp(prefix='watermelon-bench-extraction-')
+        system = WatermelonAutomationSystem(SideEffectDispatcher(InMemoryTransport(max_batches=0)),
+                                            extraction=DocumentExtractionStage(cache_dir=cache_dir))
+        try:
+            results['onboarding.documents'] = timed_calls(
+                lambda chunk: system.process_supplier_onboarding_batch({'document': chunk}),
+                chunked(self.invoice_documents(self.documents), 4 * system.extraction.workers), len)
+        finally:
+            system.shutdown(drain=False)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return results
+
+    def run_http(self) -> Dict:
+        post = self._http_poster()
+        return {
+            'http.onboarding': timed_calls(
+                lambda record: post('/api/supplier/onboard', record), self.suppliers(self.http_records)),
+            'http.churn': timed_calls(
+                lambda record: post('/api/buyer/churn-analysis', record), self.buyers(self.http_records)),
+            'http.forecast': timed_calls(
+                lambda record: post('/api/product/demand-forecast', record), self.products(self.http_records))
+        }
+
+    def _http_poster(self) -> Callable:
+        if self.url is None:
+            # In-process WSGI round trip through api_server.app, including routing and JSON encoding
+            import api_server
+            api_server.system.dispatcher.transport = InMemoryTransport(max_batches=0)
+            client = api_server.app.test_client()
+
+            def post(path, payload):
+                response = client.post(path, json=payload)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}")
+            return post
+
+        # Real server: one keep-alive connection, like a well-behaved client
+        target = urlparse(self.url)
+        connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        headers = {'Content-Type': 'application/json'}
+
+        def post(path, payload):
+            connection.request('POST', path, body=json.dumps(payload), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"{path} returned {response.status}")
+        return post
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        if result['throughput_per_sec'] < previous['throughput_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_per_sec']} -> {result['throughput_per_sec']}/s")
+        if previous['p95_ms'] and result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {result['p95_ms']} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the onboarding, churn and forecast pipelines")
+    parser.add_argument('--records', type=int, default=100000, help="records per pipeline for batch runs")
+    parser.add_argument('--single-records', type=int, default=20000, help="records for per-record runs")
+    parser.add_argument('--http-records', type=int, default=2000, help="requests per route over HTTP")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--documents', type=int, default=200, help="invoice documents for the extraction run")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', help="benchmark a running server (e.g. http://localhost:5000) "
+                                      "instead of api_server.app in-process")
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="earlier results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative slowdown before a result counts as a regression")
+    args = parser.parse_args(argv)
+
+    bench = Benchmark(args.records, args.single_records, args.http_records, args.chunk_size, args.seed, args.url,
+                      args.documents)
+    results = bench.run_in_process()
+    if not args.skip_http:
+        results.update(bench.run_http())
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'records': args.records,
+            'single_records': args.single_records,
+            'http_records': args.http_records,
+            'chunk_size': args.chunk_size,
+            'documents': args.documents,
+            'seed': args.seed,
+            'url': args.url,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+
+    print(f"{'scenario':<24}{'records/s':>14}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['throughput_per_sec']:>14,.0f}{result['p50_ms']:>12.3f}"
+              f"{result['p95_ms']:>12.3f}{result['p99_ms']:>12.3f}")
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(report, json.load(handle), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+def content_hash(payload: Any) -> str:
+    # Key order and whitespace do not change the hash, so re-serialized retries still match
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+class TTLCache:
+    # Size-bounded LRU whose entries also expire after a TTL. get_or_compute lets concurrent callers
+    # with the same key share one computation instead of all missing at once.
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600.0, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._pending: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            value = self._lookup(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value, ttl: float = None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: float = None) -> Tuple[Any, bool]:
+        # Returns (value, hit). If compute raises nothing is cached and waiting callers try again.
+        while True:
+            with self._lock:
+                value = self._lookup(key, _MISSING)
+                if value is not _MISSING:
+                    self.hits += 1
+                    return value, True
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            value = compute()
+            with self._lock:
+                self._store(key, value, ttl)
+            return value, False
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, default):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+            self.expirations += 1
+        return default
+
+    def _store(self, key, value, ttl):
+        self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+_MISSING = object()
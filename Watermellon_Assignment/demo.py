@@ -3,6 +3,26 @@ import random
 from datetime import datetime, timedelta
 from automation_system import WatermelonAutomationSystem
 
+def scale_mock_records(templates, count, seed, vary):
+    # Seeded, reproducible expansion of the hand-written mock records to any size;
+    # records are generated lazily so millions of them never sit in memory at once
+    rng = random.Random(seed)
+    for i in range(count):
+        record = dict(templates[i % len(templates)])
+        if i >= len(templates):
+            vary(record, i, rng)
+        yield record
+
+def _vary_supplier(record, i, rng):
+    record['supplier_name'] = f"{record['supplier_name']} {i}"
+    record['amount'] = round(record['amount'] * rng.uniform(0.3, 1.7), 2)
+    record['terms'] = rng.choice(('NET15', 'NET30', 'NET45'))
+
+def _vary_product(record, i, rng):
+    record['product_id'] = f"{record['product_id']}_{i}"
+    record['current_inventory'] = rng.randint(0, 300)
+    record['historical_avg'] = rng.randint(50, 250)
+
 class ProductionDemo:
     def __init__(self):
         self.system = WatermelonAutomationSystem()
@@ -40,6 +60,9 @@ class ProductionDemo:
             # Simulate processing delay
             time.sleep(2)
             print("-" * 50)
+        
+        # Let queued CRM, marketing and alert calls go out before exiting
+        self.system.flush(timeout=10)
     
     def _generate_mock_suppliers(self):
         return [
@@ -70,8 +93,26 @@ class ProductionDemo:
             }
         ]
     
-    def _generate_mock_buyers(self):
-        base_date = datetime.now()
+    def iter_mock_suppliers(self, count, seed=0):
+        return scale_mock_records(self._generate_mock_suppliers(), count, seed, _vary_supplier)
+    
+    def iter_mock_buyers(self, count, seed=0, base_date=None):
+        base_date = base_date or datetime.now()
+        
+        def vary(record, i, rng):
+            record['id'] = f"buyer_{i:07d}"
+            record['name'] = f"{record['name']} {i}"
+            record['last_order_date'] = (base_date - timedelta(days=rng.uniform(0, 120))).isoformat()
+            record['order_frequency'] = rng.randint(1, 40)
+            record['basket_size'] = round(rng.uniform(100, 3000), 2)
+        
+        return scale_mock_records(self._generate_mock_buyers(base_date), count, seed, vary)
+    
+    def iter_mock_products(self, count, seed=0):
+        return scale_mock_records(self._generate_mock_products(), count, seed, _vary_product)
+    
+    def _generate_mock_buyers(self, base_date=None):
+        base_date = base_date or datetime.now()
         return [
             {
                 'id': 'buyer_001',
@@ -0,0 +1,216 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+class Transport:
+    # Delivers one micro-batch of payloads to a destination; raise to trigger a retry
+    def send_batch(self, destination: str, payloads: List[Dict]):
+        raise NotImplementedError
+
+class ConsoleTransport(Transport):
+    # Local stub standing in for Zoho CRM, Zoho Campaigns/WhatsApp and the alerting provider
+    def send_batch(self, destination: str, payloads: List[Dict]):
+        for payload in payloads:
+            if destination == 'crm':
+                print(f"Zoho CRM Update: {payload['supplier_name']} -> {payload['status']}")
+            elif destination == 'marketing':
+                if payload['risk_level'] == "high_risk":
+                    print(f"Marketing: Discount email + WhatsApp nudge for {payload['buyer_name']}")
+                else:
+                    print(f"Marketing: Follow-up task created for {payload['buyer_name']}")
+            elif destination == 'inventory':
+                # Digests from alerting.AlertAggregator; plain alerts are still accepted
+                for alert in payload.get('alerts', [payload]):
+                    recipient = f" (to {payload['recipient']})" if 'recipient' in payload else ''
+                    print(f"Inventory Alert{recipient}: {alert['product_id']} - Risk: {alert['risk_level']}")
+
+class InMemoryTransport(Transport):
+    # Records delivered batches instead of calling out; used by tests and benchmarks
+    def __init__(self, max_batches: int = 10000):
+        self.batches = deque(maxlen=max_batches)
+        self.delivered = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, destination: str, payloads: List[Dict]):
+        with self._lock:
+            self.batches.append((destination, list(payloads)))
+            self.delivered += len(payloads)
+
+class _DestinationStats:
+    __slots__ = ('submitted', 'sent', 'failed', 'dropped', 'retries', 'batches',
+                 'flush_latency_total', 'flush_latency_max', 'flush_latency_last')
+
+    def __init__(self):
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.batches = 0
+        self.flush_latency_total = 0.0
+        self.flush_latency_max = 0.0
+        self.flush_latency_last = 0.0
+
+class SideEffectDispatcher:
+    DESTINATIONS = ('crm', 'marketing', 'inventory')
+
+    def __init__(self, transport: Transport = None, workers: int = 2, queue_size: int = 10000,
+                 batch_size: int = 100, batch_wait: float = 0.05, max_retries: int = 3,
+                 backoff: float = 0.1, enqueue_timeout: float = 0.5):
+        self.transport = transport or ConsoleTransport()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.enqueue_timeout = enqueue_timeout
+        self._pid = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._stopping = False
+        self._queues: Dict[str, queue.Queue] = {}
+        self._threads: List[threading.Thread] = []
+        self._stats = {destination: _DestinationStats() for destination in self.DESTINATIONS}
+
+    def start(self):
+        # Threads do not survive fork, so a forked worker process gets its own queues and pool
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._pending = 0
+            self._queues = {destination: queue.Queue(self.queue_size) for destination in self.DESTINATIONS}
+            self._threads = []
+            for destination in self.DESTINATIONS:
+                for n in range(self.workers):
+                    thread = threading.Thread(target=self._worker, args=(destination,),
+                                              name=f"dispatch-{destination}-{n}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def submit(self, destination: str, payload: Dict) -> bool:
+        return self.submit_many(destination, [payload]) == 1
+
+    def submit_many(self, destination: str, payloads: List[Dict]) -> int:
+        # Bulk producers enqueue pre-chunked slices, so a large batch costs one put per chunk
+        if self._pid != os.getpid():
+            self.start()
+        stats = self._stats[destination]
+        accepted = 0
+        for start in range(0, len(payloads), self.batch_size):
+            chunk = payloads[start:start + self.batch_size]
+            with self._lock:
+                if self._stopping:
+                    stats.dropped += len(payloads) - accepted
+                    return accepted
+                self._pending += len(chunk)
+                stats.submitted += len(chunk)
+            try:
+                self._queues[destination].put((time.perf_counter(), chunk), timeout=self.enqueue_timeout)
+            except queue.Full:
+                self._complete(len(chunk))
+                with self._lock:
+                    stats.dropped += len(chunk)
+                continue
+            accepted += len(chunk)
+        return accepted
+
+    def flush(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self, drain: bool = True, timeout: float = 10.0):
+        if self._pid != os.getpid():
+            return
+        if drain:
+            self.flush(timeout)
+        with self._lock:
+            self._stopping = True
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def stats(self) -> Dict:
+        destinations = {}
+        for destination, stats in self._stats.items():
+            q = self._queues.get(destination)
+            destinations[destination] = {
+                'queue_depth': q.qsize() if q is not None else 0,
+                'submitted': stats.submitted,
+                'sent': stats.sent,
+                'failed': stats.failed,
+                'dropped': stats.dropped,
+                'retries': stats.retries,
+                'batches': stats.batches,
+                'flush_latency_avg_ms': round(1000 * stats.flush_latency_total / stats.batches, 3) if stats.batches else 0.0,
+                'flush_latency_max_ms': round(1000 * stats.flush_latency_max, 3),
+                'flush_latency_last_ms': round(1000 * stats.flush_latency_last, 3)
+            }
+        return {'pending': self._pending, 'destinations': destinations}
+
+    def _worker(self, destination: str):
+        q = self._queues[destination]
+        while True:
+            try:
+                first = q.get(timeout=0.2)
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+
+            # Micro-batch: take whatever else arrives within batch_wait, up to batch_size
+            enqueued_at, payloads = first
+            batch = list(payloads)
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    _, payloads = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+                except queue.Empty:
+                    break
+                batch.extend(payloads)
+
+            self._deliver(destination, batch, enqueued_at)
+            self._complete(len(batch))
+
+    def _deliver(self, destination: str, payloads: List[Dict], enqueued_at: float):
+        stats = self._stats[destination]
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.transport.send_batch(destination, payloads)
+            except Exception:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        stats.failed += len(payloads)
+                    return
+                with self._lock:
+                    stats.retries += 1
+                # Exponential backoff with jitter so retries from several workers do not align
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            latency = time.perf_counter() - enqueued_at
+            with self._lock:
+                stats.sent += len(payloads)
+                stats.batches += 1
+                stats.flush_latency_total += latency
+                stats.flush_latency_last = latency
+                stats.flush_latency_max = max(stats.flush_latency_max, latency)
+            return
+
+    def _complete(self, count: int):
+        with self._idle:
+            self._pending -= count
+            if not self._pending:
+                self._idle.notify_all()
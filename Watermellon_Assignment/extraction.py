@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import signal
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, TimeoutError as FutureTimeout, wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List
+
+import numpy as np
+
+_SUPPLIER = re.compile(rb'(?im)^\s*(?:supplier|vendor|from)\s*:\s*(.+?)\s*$')
+_AMOUNT = re.compile(rb'(?im)^\s*(?:total|amount(?: due)?)\s*:\s*\$?\s*([\d,]+(?:\.\d+)?)\s*$')
+_TERMS = re.compile(rb'(?im)^\s*(?:payment\s+)?terms\s*:\s*(NET\s*\d+|due on receipt)\s*$')
+
+def local_extractor(document: memoryview, passes: int = 6) -> Dict:
+    # Deterministic stand-in for OCR + NLP: the bytes are treated as a 256-pixel-wide grayscale scan and
+    # denoised with a few stencil passes (the CPU-heavy part), then the text layer is parsed for fields
+    pixels = np.frombuffer(document, dtype=np.uint8)
+    image = np.zeros((-(-pixels.size // 256), 256), dtype=np.float32)
+    image.flat[:pixels.size] = pixels
+    for _ in range(passes):
+        padded = np.pad(image, 1, mode='edge')
+        image = (padded[1:-1, 1:-1] + padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]) / 5
+    fields = {'ink_coverage': round(float((image > 96).mean()), 4) if image.size else 0.0}
+    supplier = _SUPPLIER.search(document)
+    if supplier:
+        fields['supplier_name'] = supplier.group(1).decode('utf-8', 'replace')
+    amount = _AMOUNT.search(document)
+    if amount:
+        fields['amount'] = float(amount.group(1).replace(b',', b''))
+    terms = _TERMS.search(document)
+    if terms:
+        fields['terms'] = re.sub(rb'\s+', b'', terms.group(1)).decode().upper()
+    return fields
+
+def load_extractor(spec: str) -> Callable[[memoryview], Dict]:
+    # 'package.module:function'; the function must be importable by the worker processes
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+def decode_document(document) -> bytes:
+    # JSON clients send base64; in-process callers may pass bytes directly
+    if isinstance(document, (bytes, bytearray, memoryview)):
+        return bytes(document)
+    return base64.b64decode(document, validate=True)
+
+# The fork server imports the main script once, like spawn does per process, so scripts keep their work
+# under `if __name__ == '__main__'`
+_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Each shared memory block starts with the wall-clock time its worker picked the document up (0 while
+# queued), so the parent can tell a stuck document from one still waiting for a free worker
+_STARTED = struct.Struct('d')
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("document extraction timed out")
+
+def _extract_shared(extractor: Callable, name: str, size: int, timeout: float) -> Dict:
+    # Pool worker: reads the document straight from the parent's shared memory block. The interval
+    # timer interrupts an extractor that overruns, so the worker is free for the next document.
+    shm = SharedMemory(name)
+    _STARTED.pack_into(shm.buf, 0, time.time())
+    view = shm.buf[_STARTED.size:_STARTED.size + size]
+    try:
+        if timeout:
+            signal.signal(signal.SIGALRM, _raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return extractor(view)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        try:
+            view.release()
+            shm.close()
+        except BufferError:
+            # A failed extractor's traceback still references the buffer; the mapping goes with the worker
+            pass
+
+class DocumentExtractionStage:
+    # Parses invoice documents in a process pool, off the request threads and the GIL. Documents travel
+    # through shared memory rather than the pool's pickled call queue, parsed fields are cached on disk
+    # by document hash, and each document gets `timeout` seconds from when a worker starts on it.
+    def __init__(self, extractor: Callable[[memoryview], Dict] = local_extractor, workers: int = None,
+                 timeout: float = 10.0, cache_dir: str = None):
+        self.extractor = extractor
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'watermelon-extraction')
+        # Results from a different extractor must not be served from the cache
+        self._cache_salt = f"{extractor.__module__}.{extractor.__qualname__}".encode()
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'documents': 0, 'cache_hits': 0, 'extracted': 0, 'timeouts': 0, 'errors': 0,
+                       'pool_restarts': 0, 'extract_ms_total': 0.0}
+
+    def extract(self, document: bytes) -> Dict:
+        return self.extract_many([document])[0]
+
+    def extract_many(self, documents: List[bytes]) -> List[Dict]:
+        # All cache misses are in the pool at once; raises TimeoutError if any document overran
+        keys = [self._cache_key(document) for document in documents]
+        results = [self._cache_get(key) for key in keys]
+        with self._lock:
+            self._stats['documents'] += len(documents)
+            self._stats['cache_hits'] += sum(result is not None for result in results)
+        misses = [index for index, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+        pool = self._ensure_pool()
+        started = time.perf_counter()
+        blocks = []
+        try:
+            pending = {}
+            for index in misses:
+                document = documents[index]
+                shm = SharedMemory(create=True, size=_STARTED.size + len(document))
+                blocks.append(shm)
+                _STARTED.pack_into(shm.buf, 0, 0.0)
+                shm.buf[_STARTED.size:_STARTED.size + len(document)] = document
+                future = pool.submit(_extract_shared, self.extractor, shm.name, len(document), self.timeout)
+                pending[index] = (future, shm)
+            while pending:
+                wait([future for future, _ in pending.values()], timeout=0.1, return_when=FIRST_COMPLETED)
+                for index, (future, shm) in list(pending.items()):
+                    if not future.done():
+                        started_at = _STARTED.unpack_from(shm.buf)[0]
+                        if self.timeout and started_at and time.time() - started_at > self.timeout + 1.0:
+                            # The worker ignored its own timer (e.g. stuck in native code): replace the pool
+                            self._count('timeouts')
+                            self._restart_pool(pool)
+                            raise TimeoutError(f"document {index} extraction exceeded {self.timeout}s")
+                        continue
+                    del pending[index]
+                    try:
+                        results[index] = future.result()
+                    except (TimeoutError, FutureTimeout):
+                        self._count('timeouts')
+                        raise TimeoutError(f"document {index} extraction exceeded {self.timeout}s")
+                    except Exception:
+                        self._count('errors')
+                        raise
+                    self._cache_put(keys[index], results[index])
+        finally:
+            for future, _ in pending.values():
+                future.cancel()
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+        with self._lock:
+            self._stats['extracted'] += len(misses)
+            self._stats['extract_ms_total'] += 1000 * (time.perf_counter() - started)
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats, workers=self.workers, timeout=self.timeout, cache_dir=self.cache_dir)
+        total = stats.pop('extract_ms_total')
+        stats['extract_avg_ms'] = round(total / stats['extracted'], 3) if stats['extracted'] else 0.0
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pid == os.getpid():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        # Created on first use in each process, like the dispatcher's threads. By then the dispatcher,
+        # alert, persistence and server threads are running, so workers come from a fork server (a clean
+        # single-threaded process) rather than a fork of this one, which could inherit a held lock.
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(_START_METHOD))
+            return self._pool
+
+    def _restart_pool(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self._stats['pool_restarts'] += 1
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def _cache_key(self, document: bytes) -> str:
+        return hashlib.blake2b(document, key=self._cache_salt[:64], digest_size=20).hexdigest()
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _cache_get(self, key: str) -> Dict:
+        try:
+            with open(self._cache_path(key)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _cache_put(self, key: str, fields: Dict):
+        path = self._cache_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename so a concurrent reader never sees a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as handle:
+                json.dump(fields, handle)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._count('errors')
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from automation_system import churn_probabilities
+from batch_runner import chunked, read_records
+from record_store import to_epoch_seconds
+from rules import CompiledRules, RulesEngine
+
+MAGIC = b'WMBFS001'
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('id_width', '<u4'),
+    ('record_size', '<u4'),
+    ('count', '<u8'),
+    ('capacity', '<u8'),
+    ('reserved', 'V32')
+])
+
+# One fixed-width record per buyer; fields are read through strided, zero-copy views
+RECORD_DTYPE = np.dtype([
+    ('last_order_date', '<f8'),
+    ('basket_size', '<f8'),
+    ('churn_probability', '<f8'),
+    ('order_frequency', '<i4'),
+    ('risk_level', 'u1')
+], align=True)
+
+class BuyerFeatureStore:
+    # Buyer features in a memory-mapped file: <path> holds a header and the records, <path>.idx the
+    # id -> row index sorted by id (searched with np.searchsorted). One writer appends and updates;
+    # any number of processes can open the same files read-only and share the page cache.
+    def __init__(self, path: str, readonly: bool = True):
+        self.path = path
+        self.readonly = readonly
+        self._pending: Dict[bytes, int] = {}
+        self._map()
+
+    @classmethod
+    def create(cls, path: str, capacity: int = 1 << 20, id_width: int = 32) -> 'BuyerFeatureStore':
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['id_width'] = id_width
+        header['record_size'] = RECORD_DTYPE.itemsize
+        header['capacity'] = capacity
+        with open(path, 'wb') as handle:
+            handle.write(header.tobytes())
+            handle.truncate(HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize)
+        np.zeros(0, dtype=[('id', f'S{id_width}'), ('row', '<i8')]).tofile(path + '.idx')
+        return cls(path, readonly=False)
+
+    def _map(self):
+        mode = 'r' if self.readonly else 'r+'
+        self._header = np.memmap(self.path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        if self._header['magic'][0] != MAGIC or self._header['record_size'][0] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{self.path} is not a buyer feature store")
+        self.id_width = int(self._header['id_width'][0])
+        self._records = np.memmap(self.path, dtype=RECORD_DTYPE, mode=mode, offset=HEADER_DTYPE.itemsize,
+                                  shape=(int(self._header['capacity'][0]),))
+        index = np.fromfile(self.path + '.idx', dtype=[('id', f'S{self.id_width}'), ('row', '<i8')])
+        self._index_ids = index['id']
+        self._index_rows = index['row']
+
+    def refresh(self):
+        # Readers pick up rows and index entries published by the writer's last sync()
+        self._map()
+
+    def __len__(self):
+        return int(self._header['count'][0])
+
+    @property
+    def capacity(self) -> int:
+        return int(self._header['capacity'][0])
+
+    def records(self, start: int = 0, stop: int = None) -> np.ndarray:
+        # Zero-copy structured view; view['basket_size'] etc. are strided views into the mapping
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._records[start:stop]
+
+    def iter_chunks(self, chunk_rows: int = 1 << 20, start: int = 0, stop: int = None) -> Iterator[Tuple[int, np.ndarray]]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        for offset in range(start, stop, chunk_rows):
+            yield offset, self._records[offset:min(offset + chunk_rows, stop)]
+
+    def rows_of(self, ids: Iterable[str]) -> np.ndarray:
+        # -1 marks unknown ids
+        return self._lookup(self._keys(ids))
+
+    def _keys(self, ids: Iterable[str]) -> np.ndarray:
+        ids = list(ids)
+        try:
+            # Vectorized ASCII encoding; non-ASCII ids fall back to per-id UTF-8
+            text = np.array(ids, dtype=np.str_)
+            width = text.dtype.itemsize // 4
+            keys = text.astype(f'S{max(width, 1)}')
+        except UnicodeEncodeError:
+            keys = np.array([buyer_id.encode('utf-8') for buyer_id in ids], dtype=np.bytes_)
+            width = keys.dtype.itemsize
+        if width > self.id_width:
+            raise ValueError(f"buyer ids longer than {self.id_width} bytes are not supported")
+        return keys.astype(f'S{self.id_width}')
+
+    def _lookup(self, keys: np.ndarray) -> np.ndarray:
+        rows = np.full(keys.size, -1, dtype=np.int64)
+        if self._index_ids.size:
+            pos = np.searchsorted(self._index_ids, keys)
+            found = pos < self._index_ids.size
+            found[found] = self._index_ids[pos[found]] == keys[found]
+            rows[found] = self._index_rows[pos[found]]
+        if self._pending:
+            missing = np.flatnonzero(rows < 0)
+            pending = self._pending
+            rows[missing] = [pending.get(key, -1) for key in keys[missing].tolist()]
+        return rows
+
+    def upsert(self, ids: List[str], last_order_date: np.ndarray, order_frequency: np.ndarray,
+               basket_size: np.ndarray) -> np.ndarray:
+        # Existing buyers are overwritten in place; new ones are appended and indexed on sync()
+        if self.readonly:
+            raise PermissionError(f"{self.path} is open read-only")
+        keys = self._keys(ids)
+        rows = self._lookup(keys)
+        new = np.flatnonzero(rows < 0)
+        if new.size:
+            count = len(self)
+            # An id repeated within the call gets a single row
+            new_keys, inverse = np.unique(keys[new], return_inverse=True)
+            self._reserve(count + new_keys.size)
+            rows[new] = count + inverse.reshape(-1)
+            self._pending.update(zip(new_keys.tolist(), range(count, count + new_keys.size)))
+            self._header['count'] = count + new_keys.size
+        records = self._records
+        records['last_order_date'][rows] = last_order_date
+        records['order_frequency'][rows] = order_frequency
+        records['basket_size'][rows] = basket_size
+        return rows
+
+    def score(self, reference_epoch: float, chunk_rows: int = 1 << 20, start: int = 0, stop: int = None,
+              out: np.ndarray = None, rules: CompiledRules = None) -> Dict[str, int]:
+        # Chunked scoring over the mapped records. Results go to `out` (any array indexed by row) or,
+        # for a writable store, back into the churn_probability/risk_level fields. risk_level holds the
+        # band index of the churn_risk table.
+        if out is None and self.readonly:
+            raise PermissionError("read-only store needs an output array")
+        table = (rules or RulesEngine().current)['churn_risk']
+        bands = np.zeros(len(table.outputs), dtype=np.int64)
+        for offset, chunk in self.iter_chunks(chunk_rows, start, stop):
+            last_order_days = np.floor((reference_epoch - chunk['last_order_date']) / 86400)
+            probs = churn_probabilities(last_order_days, chunk['order_frequency'], chunk['basket_size'])
+            levels = table.codes(probs)
+            if out is None:
+                chunk['churn_probability'] = probs
+                chunk['risk_level'] = levels
+            else:
+                out[offset:offset + len(chunk)] = probs
+            bands += np.bincount(levels, minlength=len(table.outputs))
+        return dict(zip(table.outputs, bands.tolist()))
+
+    def sync(self):
+        # Merge newly appended ids into the sorted index and make rows and index visible to readers
+        if self._pending:
+            pending_ids = np.fromiter(self._pending, dtype=f'S{self.id_width}', count=len(self._pending))
+            pending_rows = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+            ids = np.concatenate([self._index_ids, pending_ids])
+            rows = np.concatenate([self._index_rows, pending_rows])
+            order = np.argsort(ids, kind='stable')
+            index = np.empty(ids.size, dtype=[('id', f'S{self.id_width}'), ('row', '<i8')])
+            index['id'] = ids[order]
+            index['row'] = rows[order]
+            tmp_path = self.path + '.idx.tmp'
+            index.tofile(tmp_path)
+            os.replace(tmp_path, self.path + '.idx')
+            self._index_ids = index['id']
+            self._index_rows = index['row']
+            self._pending = {}
+        self._records.flush()
+        self._header.flush()
+
+    def _reserve(self, size: int):
+        capacity = self.capacity
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self._records.flush()
+        with open(self.path, 'r+b') as handle:
+            handle.truncate(HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize)
+        self._header['capacity'] = capacity
+        self._header.flush()
+        pending = self._pending
+        self._map()
+        self._pending = pending
+
+def _score_range(path: str, scores_path: str, reference_epoch: float, start: int, stop: int,
+                 chunk_rows: int, rules: CompiledRules) -> Dict[str, int]:
+    # Worker: maps the features read-only and writes its disjoint slice of the shared scores file
+    store = BuyerFeatureStore(path, readonly=True)
+    scores = np.memmap(scores_path, dtype=np.float64, mode='r+', shape=(len(store),))
+    bands = store.score(reference_epoch, chunk_rows, start, stop, out=scores, rules=rules)
+    scores.flush()
+    return bands
+
+def rescore(path: str, reference_epoch: float, workers: int = os.cpu_count() or 1,
+            chunk_rows: int = 1 << 20, rules: CompiledRules = None) -> Dict:
+    # Full-population rescoring split by row range across processes; nothing is pickled but the
+    # compiled rules and the band counts. The writer then folds the shared scores back into the records.
+    rules = rules or RulesEngine().current
+    table = rules['churn_risk']
+    store = BuyerFeatureStore(path, readonly=False)
+    count = len(store)
+    started = time.perf_counter()
+    if workers <= 1 or count <= chunk_rows:
+        bands = store.score(reference_epoch, chunk_rows, rules=rules)
+    else:
+        scores_path = path + '.scores'
+        np.memmap(scores_path, dtype=np.float64, mode='w+', shape=(max(count, 1),)).flush()
+        step = -(-count // workers)
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_score_range, path, scores_path, reference_epoch, start,
+                                   min(start + step, count), chunk_rows, rules)
+                       for start in range(0, count, step)]
+            bands = dict.fromkeys(table.outputs, 0)
+            for future in futures:
+                for level, n in future.result().items():
+                    bands[level] += n
+        scores = np.memmap(scores_path, dtype=np.float64, mode='r', shape=(count,))
+        for offset, chunk in store.iter_chunks(chunk_rows):
+            probs = scores[offset:offset + len(chunk)]
+            chunk['churn_probability'] = probs
+            chunk['risk_level'] = table.codes(probs)
+        del scores
+        os.remove(scores_path)
+    store.sync()
+    return {'buyers': count, 'bands': bands, 'rule_version': rules.version,
+            'seconds': round(time.perf_counter() - started, 3)}
+
+def import_records(path: str, input_path: str, chunk_size: int = 100000) -> Dict:
+    store = (BuyerFeatureStore(path, readonly=False) if os.path.exists(path)
+             else BuyerFeatureStore.create(path))
+    rows = 0
+    for chunk in chunked(read_records(input_path, 'churn'), chunk_size):
+        store.upsert(
+            [str(record['id']) for record in chunk],
+            np.fromiter((to_epoch_seconds(record['last_order_date']) for record in chunk), dtype=np.float64),
+            np.fromiter((record['order_frequency'] for record in chunk), dtype=np.int32),
+            np.fromiter((record['basket_size'] for record in chunk), dtype=np.float64)
+        )
+        rows += len(chunk)
+    store.sync()
+    return {'imported': rows, 'buyers': len(store)}
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Memory-mapped buyer feature store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('import', help="add or update buyers from a JSONL/CSV export")
+    load.add_argument('store')
+    load.add_argument('input')
+    score = commands.add_parser('rescore', help="rescore every buyer in the store")
+    score.add_argument('store')
+    score.add_argument('--reference-time', help="ISO timestamp (default: now)")
+    score.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    score.add_argument('--chunk-rows', type=int, default=1 << 20)
+    score.add_argument('--rules', default=os.environ.get('WATERMELON_RULES'),
+                       help="decision-table JSON file (default: built-in thresholds)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        result = import_records(args.store, args.input)
+    else:
+        reference = datetime.fromisoformat(args.reference_time) if args.reference_time else None
+        engine = RulesEngine(args.rules)
+        if engine.last_error:
+            parser.error(f"cannot load rules: {engine.last_error}")
+        result = rescore(args.store, to_epoch_seconds(reference), args.workers, args.chunk_rows, engine.current)
+    print(result, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List, Tuple
+
+# Upper bounds in seconds, from 50 microseconds (scalar scoring) to 10 seconds (large batches)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total', 'count', '_lock')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        idx = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+class MetricsRegistry:
+    # Per-process metrics rendered in the Prometheus text format. Hot-path cost is one bisect and
+    # one uncontended lock per observation.
+    STAGE_METRIC = 'watermelon_stage_duration_seconds'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Tuple[str, str, str, Callable]] = []
+
+    def stage(self, name: str) -> Histogram:
+        histogram = self._stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._stages.setdefault(name, Histogram(self.buckets))
+        return histogram
+
+    def timed(self, stage: str):
+        # Decorator: record the wall time of every call under the given stage name
+        def decorator(func):
+            histogram = self.stage(stage)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def counter_value(self, name: str, **labels) -> float:
+        return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def register_collector(self, name: str, metric_type: str, help_text: str, callback: Callable):
+        # callback() returns [(labels dict, value), ...] and is evaluated at scrape time only
+        self._collectors.append((name, metric_type, help_text, callback))
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.STAGE_METRIC} Time spent in each automation pipeline stage",
+            f"# TYPE {self.STAGE_METRIC} histogram"
+        ]
+        for stage, histogram in sorted(self._stages.items()):
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.STAGE_METRIC}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.STAGE_METRIC}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{self.STAGE_METRIC}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{self.STAGE_METRIC}_count{{stage="{stage}"}} {count}')
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        for name, series in sorted(counters.items()):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for name, metric_type, help_text, callback in self._collectors:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in callback():
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe('watermelon_requests_total', "Pipeline invocations (batch calls count each record)")
+REGISTRY.describe('watermelon_onboarding_decisions_total', "Supplier onboarding decisions by AutomationStatus")
+REGISTRY.describe('watermelon_alerts_total',
+                  "Marketing triggers and inventory alerts accepted for delivery (inventory_digest: alert "
+                  "entries handed to the dispatcher in digests, one per recipient)")
@@ -0,0 +1,235 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+_SQL_TYPES = {
+    'str': 'TEXT',
+    'category': 'TEXT',
+    'float': 'REAL',
+    'epoch': 'REAL',
+    'int': 'INTEGER',
+    'bytes': 'BLOB'
+}
+
+class _Table:
+    __slots__ = ('name', 'fields', 'key', 'insert_sql')
+
+    def __init__(self, name: str, schema: Dict[str, str], key: str):
+        self.name = name
+        self.fields = list(schema)
+        self.key = key
+        verb = 'INSERT OR REPLACE' if key else 'INSERT'
+        self.insert_sql = (f"{verb} INTO {name} ({', '.join(self.fields)}) "
+                           f"VALUES ({', '.join('?' * len(self.fields))})")
+
+class SQLitePersistence:
+    # Write-behind persistence for the in-memory stores. Requests only enqueue column batches; a single
+    # writer thread coalesces them by primary key and commits one transaction per flush. WAL with
+    # synchronous=NORMAL means commits do not fsync, so durability is bounded by flush_interval.
+    def __init__(self, path: str, flush_interval: float = 1.0, max_pending: int = 1000,
+                 snapshot_dir: str = None, snapshot_interval: float = 3600.0, keep_snapshots: int = 3):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.keep_snapshots = keep_snapshots
+        self.max_pending = max_pending
+        self._tables: Dict[str, _Table] = {}
+        # deque.append is atomic, so writers need no lock; the writer thread drains it on each tick
+        self._batches = deque()
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._flush_requests = 0
+        self._flushes_done = 0
+        self._pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._stats = {'rows_written': 0, 'commits': 0, 'last_commit_ms': 0.0, 'snapshots': 0, 'errors': 0,
+                       'retries': 0}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self, path: str = None) -> sqlite3.Connection:
+        conn = sqlite3.connect(path or self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def create_table(self, name: str, schema: Dict[str, str], key: str = None, indexed: Iterable[str] = ()):
+        table = self._tables[name] = _Table(name, schema, key)
+        columns = ', '.join(
+            f"{field} {_SQL_TYPES[kind]}{' PRIMARY KEY' if field == key else ''}" for field, kind in schema.items()
+        )
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns})")
+            for field in indexed:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{field} ON {name} ({field})")
+        return table
+
+    def start(self):
+        # Like the dispatcher, a forked worker starts its own writer thread
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._writer, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, table: str, columns: Dict[str, Iterable]):
+        # Non-blocking unless the writer is max_pending batches behind (backpressure, not data loss)
+        if self._pid != os.getpid():
+            self.start()
+        self._batches.append((table, columns))
+        while len(self._batches) > self.max_pending:
+            self._wake.set()
+            time.sleep(0.005)
+
+    def flush(self, timeout: float = None) -> bool:
+        # Everything written before this call is committed when it returns True
+        if self._pid != os.getpid():
+            return True
+        if self._closed:
+            # The writer is gone; waiting would only run out the timeout
+            return not self._batches
+        with self._flushed:
+            self._flush_requests += 1
+            target = self._flush_requests
+            self._wake.set()
+            return self._flushed.wait_for(lambda: self._flushes_done >= target, timeout)
+
+    def close(self, timeout: float = 10.0):
+        # Idempotent: gunicorn's worker_exit hook and atexit both end up here
+        if self._pid != os.getpid() or self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def load(self, table: str, source: str = None) -> Dict[str, List]:
+        # Whole table as columns, ordered by primary key (or insertion order for log tables)
+        spec = self._tables[table]
+        conn = self._connect(source)
+        try:
+            order = spec.key or 'rowid'
+            rows = conn.execute(f"SELECT {', '.join(spec.fields)} FROM {table} ORDER BY {order}").fetchall()
+        except sqlite3.OperationalError:
+            # Snapshot taken before this table existed
+            rows = []
+        finally:
+            conn.close()
+        if not rows:
+            return {field: [] for field in spec.fields}
+        return dict(zip(spec.fields, (list(column) for column in zip(*rows))))
+
+    def snapshot(self, path: str = None) -> str:
+        # VACUUM INTO writes a compact, consistent copy without blocking the writer for long
+        if path is None:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = os.path.join(self.snapshot_dir, f"watermelon-{datetime.now():%Y%m%d-%H%M%S}.db")
+        conn = self._connect()
+        try:
+            conn.execute("VACUUM INTO ?", (path,))
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats['snapshots'] += 1
+        if self.snapshot_dir and os.path.dirname(path) == os.path.normpath(self.snapshot_dir):
+            for old in self.snapshots()[:-self.keep_snapshots]:
+                os.remove(old)
+        return path
+
+    def snapshots(self) -> List[str]:
+        if not self.snapshot_dir:
+            return []
+        return sorted(glob.glob(os.path.join(self.snapshot_dir, 'watermelon-*.db')))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, pending_batches=len(self._batches), path=self.path)
+
+    def _writer(self):
+        conn = self._connect()
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                requested = self._flush_requests
+            # Everything that queued up since the last tick goes into the same transaction
+            batches = []
+            while self._batches:
+                batches.append(self._batches.popleft())
+            if batches and not self._commit(conn, batches):
+                # Back at the head of the queue, ahead of newer writes, for the next tick; flush() keeps
+                # waiting until they are in
+                self._batches.extendleft(reversed(batches))
+                continue
+            with self._flushed:
+                self._flushes_done = requested
+                self._flushed.notify_all()
+            if self.snapshot_dir and time.monotonic() >= next_snapshot:
+                next_snapshot = time.monotonic() + self.snapshot_interval
+                try:
+                    self.snapshot()
+                except (OSError, sqlite3.Error):
+                    with self._lock:
+                        self._stats['errors'] += 1
+        if self._batches and self._commit(conn, list(self._batches)):
+            self._batches.clear()
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batches: List) -> bool:
+        # False when the batches should be retried: the database was locked, full or unreachable.
+        # Rows SQLite rejects outright would fail every retry, so those are counted and dropped.
+        started = time.perf_counter()
+        keyed: Dict[str, Dict] = {}
+        appended: Dict[str, List] = {}
+        for table, columns in batches:
+            spec = self._tables[table]
+            values = [
+                column.tolist() if isinstance(column, np.ndarray) else list(column)
+                for column in (columns[field] for field in spec.fields)
+            ]
+            rows = zip(*values)
+            if spec.key:
+                # Later writes to the same key within a flush replace earlier ones
+                position = spec.fields.index(spec.key)
+                target = keyed.setdefault(table, {})
+                for row in rows:
+                    target[row[position]] = row
+            else:
+                appended.setdefault(table, []).extend(rows)
+        written = 0
+        try:
+            with conn:
+                for table, rows in keyed.items():
+                    conn.executemany(self._tables[table].insert_sql, rows.values())
+                    written += len(rows)
+                for table, rows in appended.items():
+                    conn.executemany(self._tables[table].insert_sql, rows)
+                    written += len(rows)
+        except sqlite3.OperationalError:
+            with self._lock:
+                self._stats['errors'] += 1
+                self._stats['retries'] += 1
+            return False
+        except sqlite3.Error:
+            written = 0
+            with self._lock:
+                self._stats['errors'] += 1
+        with self._lock:
+            self._stats['rows_written'] += written
+            self._stats['commits'] += 1
+            self._stats['last_commit_ms'] = round(1000 * (time.perf_counter() - started), 3)
+        return True
@@ -0,0 +1,63 @@
+import heapq
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+class TopKIndex:
+    # Max-heap of (score, key) with lazy deletion: an update pushes a new entry and marks the old one
+    # stale via a sequence number. top(k) skips stale entries, so it costs O((k + stale) log n) and
+    # stale entries are discarded as they surface. Not thread-safe; callers hold their own lock.
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._current: Dict[Hashable, Tuple[float, int]] = {}
+        self._seq = 0
+
+    def update(self, key: Hashable, score: float):
+        self._seq += 1
+        self._current[key] = (score, self._seq)
+        heapq.heappush(self._heap, (-score, self._seq, key))
+        self._maybe_compact()
+
+    def update_many(self, keys: Iterable[Hashable], scores: Iterable[float]):
+        entries = []
+        for key, score in zip(keys, scores):
+            self._seq += 1
+            self._current[key] = (score, self._seq)
+            entries.append((-score, self._seq, key))
+        if len(entries) > len(self._heap) // 8:
+            # Bulk load: heapify is O(n) against O(m log n) for m pushes
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+        self._maybe_compact()
+
+    def remove(self, key: Hashable):
+        self._current.pop(key, None)
+
+    def score(self, key: Hashable):
+        entry = self._current.get(key)
+        return None if entry is None else entry[0]
+
+    def top(self, k: int) -> List[Tuple[Hashable, float]]:
+        result = []
+        live = []
+        while self._heap and len(result) < k:
+            entry = heapq.heappop(self._heap)
+            neg_score, seq, key = entry
+            current = self._current.get(key)
+            if current is None or current[1] != seq:
+                continue
+            live.append(entry)
+            result.append((key, -neg_score))
+        for entry in live:
+            heapq.heappush(self._heap, entry)
+        return result
+
+    def __len__(self):
+        return len(self._current)
+
+    def _maybe_compact(self):
+        # Bound memory when the same keys are rescored over and over
+        if len(self._heap) > 2 * len(self._current) + 1024:
+            self._heap = [(-score, seq, key) for key, (score, seq) in self._current.items()]
+            heapq.heapify(self._heap)
@@ -0,0 +1,395 @@
+import cProfile
+import hmac
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+from flask import Response, g, jsonify, request, send_file
+
+# Clients ask for a cProfile of one request with this header; the response names the capture
+PROFILE_HEADER = 'X-Watermelon-Profile'
+PROFILE_ID_HEADER = 'X-Watermelon-Profile-Id'
+
+_PROFILE_ID = re.compile(r'[\w-]+')
+_TRUTHY = ('1', 'true', 'yes', 'on')
+# Innermost frames kept per stack sample; deeper stacks lose their outermost (server loop) frames
+_MAX_DEPTH = 64
+
+def _write_atomic(path: str, write):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class ProfileStore:
+    # One JSON file per capture (plus the raw pstats dump for cProfile captures), shared by every worker
+    # process pointed at the same directory. Past max_profiles the oldest captures are deleted.
+    def __init__(self, directory: str = None, max_profiles: int = 200):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'watermelon-profiles')
+        self.max_profiles = max_profiles
+        self._counter = itertools.count(1)
+
+    def new_id(self) -> str:
+        # Sorts by capture time; the pid keeps workers sharing the directory apart
+        return f"{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}-{next(self._counter)}"
+
+    def save(self, record: Dict, stats: pstats.Stats = None):
+        os.makedirs(self.directory, exist_ok=True)
+        if stats is not None:
+            _write_atomic(self._path(record['id'], '.prof'), stats.dump_stats)
+
+        def write_json(path):
+            with open(path, 'w') as handle:
+                json.dump(record, handle)
+
+        _write_atomic(self._path(record['id'], '.json'), write_json)
+        self._prune()
+
+    def list(self, limit: int = 100) -> List[Dict]:
+        # Newest first, without the breakdowns
+        summaries = []
+        for profile_id in reversed(self._ids()):
+            if len(summaries) >= limit:
+                break
+            record = self.load(profile_id)
+            if record is not None:
+                summaries.append({key: value for key, value in record.items() if key not in ('functions', 'stacks')})
+        return summaries
+
+    def load(self, profile_id: str) -> Dict:
+        path = self.file(profile_id, '.json')
+        if path is None:
+            return None
+        try:
+            with open(path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            # Pruned by another worker, or still being replaced
+            return None
+
+    def file(self, profile_id: str, suffix: str) -> str:
+        # Ids come from URLs, so anything that is not a plain id never reaches the filesystem
+        if not _PROFILE_ID.fullmatch(profile_id):
+            return None
+        path = self._path(profile_id, suffix)
+        return path if os.path.exists(path) else None
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def _ids(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json'))
+
+    def _prune(self):
+        ids = self._ids()
+        for profile_id in ids[:max(len(ids) - self.max_profiles, 0)]:
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(self._path(profile_id, suffix))
+                except OSError:
+                    pass
+
+class _Capture:
+    __slots__ = ('id', 'name', 'trigger', 'thread', 'started', 'started_at', 'profile', 'samples', 'status')
+
+    def __init__(self, name: str, trigger: str):
+        self.id = None
+        self.name = name
+        self.trigger = trigger
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat()
+        self.profile = None
+        # Stack (tuple of code objects, outermost first) -> seconds observed there
+        self.samples = Counter()
+        self.status = None
+
+def _label(filename: str, line: int, function: str) -> str:
+    if filename == '~':
+        # Builtins carry their description in the function name
+        return function
+    return f"{function} ({os.path.basename(filename)}:{line})"
+
+def _code_label(code) -> str:
+    return _label(code.co_filename, code.co_firstlineno, getattr(code, 'co_qualname', code.co_name))
+
+def _stack(frame) -> tuple:
+    codes = []
+    while frame is not None and len(codes) < _MAX_DEPTH:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return tuple(reversed(codes))
+
+def _profile_breakdown(stats: pstats.Stats, limit: int) -> List[Dict]:
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': _label(*function),
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'self_ms': round(1000 * self_time, 3),
+            'total_ms': round(1000 * total_time, 3)
+        }
+        for function, (primitive_calls, calls, self_time, total_time, _) in rows
+    ]
+
+def _sample_breakdown(samples: Counter, limit: int):
+    # Folded stacks ("outer;...;inner") with the time seen in each, and per-function self/total time
+    self_time = Counter()
+    total_time = Counter()
+    stacks = Counter()
+    for stack, seconds in samples.items():
+        labels = [_code_label(code) for code in stack]
+        stacks[';'.join(labels)] += seconds
+        self_time[labels[-1]] += seconds
+        for label in set(labels):
+            total_time[label] += seconds
+    functions = [
+        {'function': label, 'self_ms': round(1000 * self_time[label], 3), 'total_ms': round(1000 * seconds, 3)}
+        for label, seconds in total_time.most_common(limit)
+    ]
+    return functions, [{'stack': stack, 'ms': round(1000 * seconds, 3)} for stack, seconds in stacks.most_common()]
+
+class RequestProfiler:
+    # Two ways a request gets a breakdown:
+    #  * forced (header) or sampled (sample_rate) requests run under cProfile: exact call counts and
+    #    times for everything the request thread calls;
+    #  * with slow_ms set, a background thread samples the stacks of in-flight requests every
+    #    sample_interval, and a request that ends up slower than slow_ms is saved with where its time went.
+    # With both off, begin() returns None after one random() at most.
+    def __init__(self, store: ProfileStore = None, sample_rate: float = 0.0, slow_ms: float = None,
+                 sample_interval: float = 0.01, token: str = None, top_functions: int = 40):
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms or None
+        self.sample_interval = sample_interval
+        self.token = token
+        self.top_functions = top_functions
+        self._active = set()
+        self._changed = threading.Condition()
+        self._sampler_pid = None
+        self._stats = {'profiled': 0, 'slow_captured': 0, 'errors': 0}
+
+    def requested(self, header_value: str) -> bool:
+        # With a token configured the header must carry it; otherwise any truthy value will do
+        if not header_value:
+            return False
+        if self.token:
+            return hmac.compare_digest(header_value, self.token)
+        return header_value.lower() in _TRUTHY
+
+    def begin(self, name: str, force: bool = False) -> _Capture:
+        if force:
+            trigger = 'header'
+        elif self.sample_rate and random.random() < self.sample_rate:
+            trigger = 'sampled'
+        elif self.slow_ms:
+            trigger = None
+        else:
+            return None
+        capture = _Capture(name, trigger)
+        if self.slow_ms:
+            self._ensure_sampler()
+            with self._changed:
+                self._active.add(capture)
+                self._changed.notify()
+        if trigger:
+            capture.id = self.store.new_id()
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                capture.profile = profile
+            except ValueError:
+                # Another profiler already owns the interpreter (one at a time on Python 3.12+)
+                pass
+        return capture
+
+    def end(self, capture: _Capture, error: BaseException = None) -> str:
+        # Returns the capture id if the request was saved
+        elapsed_ms = 1000 * (time.perf_counter() - capture.started)
+        if capture.profile is not None:
+            capture.profile.disable()
+        if self.slow_ms:
+            with self._changed:
+                self._active.discard(capture)
+        slow = self.slow_ms is not None and elapsed_ms >= self.slow_ms
+        if capture.trigger is None and not slow:
+            return None
+        record = {
+            'id': capture.id or self.store.new_id(),
+            'name': capture.name,
+            'trigger': capture.trigger or 'slow',
+            'started_at': capture.started_at,
+            'duration_ms': round(elapsed_ms, 3),
+            'slow': slow,
+            'status': capture.status,
+            'error': f"{type(error).__name__}: {error}" if error is not None else None,
+            'pid': os.getpid()
+        }
+        stats = None
+        if capture.profile is not None:
+            stats = pstats.Stats(capture.profile)
+            record.update(kind='cprofile', functions=_profile_breakdown(stats, self.top_functions))
+        else:
+            functions, stacks = _sample_breakdown(capture.samples, self.top_functions)
+            record.update(kind='sampled', sample_interval_ms=1000 * self.sample_interval, functions=functions,
+                          stacks=stacks)
+        try:
+            self.store.save(record, stats)
+        except OSError:
+            self._count('errors')
+            return None
+        self._count('profiled' if capture.trigger else 'slow_captured')
+        return record['id']
+
+    def cancel(self, capture: _Capture):
+        # Stops profiling a request without saving anything
+        if capture.profile is not None:
+            capture.profile.disable()
+        if self.slow_ms:
+            with self._changed:
+                self._active.discard(capture)
+
+    @contextmanager
+    def profile(self, name: str, force: bool = False):
+        # For work outside a request, e.g. the dashboard's demo steps
+        capture = self.begin(name, force)
+        if capture is None:
+            yield
+            return
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.end(capture, error)
+
+    def stats(self) -> Dict:
+        with self._changed:
+            stats = dict(self._stats, in_flight_sampled=len(self._active))
+        return dict(stats, sample_rate=self.sample_rate, slow_ms=self.slow_ms, directory=self.store.directory,
+                    max_profiles=self.store.max_profiles)
+
+    def _count(self, field: str):
+        with self._changed:
+            self._stats[field] += 1
+
+    def _ensure_sampler(self):
+        # Started on first use in each process, like the dispatcher's threads
+        if self._sampler_pid == os.getpid():
+            return
+        with self._changed:
+            if self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+            # Entries inherited over fork belong to the parent's threads
+            self._active = set()
+        threading.Thread(target=self._sample, name="profile-sampler", daemon=True).start()
+
+    def _sample(self):
+        last = time.perf_counter()
+        while True:
+            with self._changed:
+                if not self._active:
+                    # Idle without waking up until a request starts
+                    self._changed.wait_for(lambda: self._active)
+                    last = time.perf_counter()
+            time.sleep(self.sample_interval)
+            now = time.perf_counter()
+            period, last = now - last, now
+            frames = sys._current_frames()
+            with self._changed:
+                active = list(self._active)
+            stacks = {capture: _stack(frames[capture.thread]) for capture in active if capture.thread in frames}
+            del frames
+            with self._changed:
+                for capture, stack in stacks.items():
+                    # A request that finished meanwhile has already been rendered
+                    if capture in self._active:
+                        capture.samples[stack] += period
+
+def configured_profiler() -> RequestProfiler:
+    env = os.environ.get
+    return RequestProfiler(
+        ProfileStore(env('WATERMELON_PROFILE_DIR'), max_profiles=int(env('WATERMELON_PROFILE_MAX', 200))),
+        sample_rate=float(env('WATERMELON_PROFILE_SAMPLE_RATE', 0)),
+        slow_ms=float(env('WATERMELON_SLOW_REQUEST_MS', 0)),
+        sample_interval=float(env('WATERMELON_PROFILE_SAMPLE_INTERVAL_MS', 10)) / 1000,
+        token=env('WATERMELON_PROFILE_TOKEN')
+    )
+
+def install(app, profiler: RequestProfiler, skip=()):
+    # Profiles the requests of the app and adds GET /api/profiles and GET /api/profiles/<id>. Left out:
+    # the profile routes, the endpoints in skip (e.g. long-lived event streams) and any streamed
+    # response, whose duration is the client's pace rather than ours and would crowd out real captures
+    skipped = ('list_profiles', 'download_profile') + tuple(skip)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint not in skipped:
+            capture = profiler.begin(f"{request.method} {request.path}",
+                                     force=profiler.requested(request.headers.get(PROFILE_HEADER)))
+            if capture is not None:
+                g.profile_capture = capture
+
+    @app.after_request
+    def tag_profile(response):
+        capture = g.get('profile_capture')
+        if capture is not None and response.is_streamed:
+            profiler.cancel(g.pop('profile_capture'))
+        elif capture is not None:
+            capture.status = response.status_code
+            if capture.id:
+                response.headers[PROFILE_ID_HEADER] = capture.id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        capture = g.pop('profile_capture', None)
+        if capture is not None:
+            profiler.end(capture, exc)
+
+    @app.route('/api/profiles', methods=['GET'])
+    def list_profiles():
+        limit = min(max(request.args.get('limit', default=100, type=int), 1), profiler.store.max_profiles)
+        return jsonify({'profiles': profiler.store.list(limit), 'profiler': profiler.stats()})
+
+    @app.route('/api/profiles/<profile_id>', methods=['GET'])
+    def download_profile(profile_id):
+        # format=json (default), pstats (cProfile captures, for pstats/snakeviz) or folded (sampled
+        # captures, for flamegraph tools; weights in microseconds)
+        fmt = request.args.get('format', 'json')
+        if fmt == 'pstats':
+            path = profiler.store.file(profile_id, '.prof')
+            if path is None:
+                return jsonify({'error': 'no pstats data for this profile'}), 404
+            return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                             download_name=f"{profile_id}.prof")
+        record = profiler.store.load(profile_id)
+        if record is None:
+            return jsonify({'error': 'profile not found'}), 404
+        if fmt == 'folded':
+            if record['kind'] != 'sampled':
+                return jsonify({'error': 'folded stacks are only kept for sampled profiles'}), 404
+            body = ''.join(f"{row['stack']} {round(1000 * row['ms'])}\n" for row in record['stacks'])
+            return Response(body, mimetype='text/plain',
+                            headers={'Content-Disposition': f'attachment; filename={profile_id}.folded'})
+        if fmt != 'json':
+            return jsonify({'error': "format must be json, pstats or folded"}), 400
+        return jsonify(record)
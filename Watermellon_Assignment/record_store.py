@@ -0,0 +1,321 @@
+from dataclasses import fields
+from datetime import datetime, timedelta
+from typing import Dict, List, Iterable
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_epoch_seconds(value) -> float:
+    # Naive wall-clock datetimes are mapped onto a fixed epoch so differences match datetime arithmetic
+    if value is None:
+        value = datetime.now()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value - EPOCH).total_seconds()
+
+def from_epoch_seconds(value: float) -> datetime:
+    return EPOCH + timedelta(seconds=value)
+
+_DTYPES = {
+    'float': np.float64,
+    'int': np.int64,
+    'epoch': np.float64,
+    'category': np.uint8
+}
+
+class ColumnarStore:
+    # Column-per-field record storage. Numeric fields live in NumPy arrays, categorical fields as
+    # uint8 codes, strings in plain lists. Rows are addressed by a monotonically assigned row id.
+    __slots__ = ('record_type', '_schema', '_columns', '_categories', '_codes', '_key_field',
+                 '_key_index', '_name_field', '_name_index', '_secondary', '_size', '_capacity')
+
+    def __init__(self, record_type, schema: Dict[str, str], key_field: str = None,
+                 name_field: str = None, indexed: Iterable[str] = (), capacity: int = 1024):
+        self.record_type = record_type
+        self._schema = schema
+        self._key_field = key_field
+        self._key_index: Dict[str, int] = {}
+        self._name_field = name_field
+        self._name_index: Dict[str, List[int]] = {}
+        self._categories = {field: [] for field, kind in schema.items() if kind == 'category'}
+        self._codes = {field: {} for field in self._categories}
+        self._secondary = {field: [] for field in indexed}
+        self._size = 0
+        self._capacity = capacity
+        self._columns = {
+            field: [] if kind == 'str' else np.zeros(capacity, dtype=_DTYPES[kind])
+            for field, kind in schema.items()
+        }
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key) -> bool:
+        return key in self._key_index
+
+    def append(self, values: Dict) -> int:
+        row = self._size
+        self._reserve(row + 1)
+        self._size += 1
+        self._write_row(row, values, is_new=True)
+        if self._key_field is not None:
+            self._key_index[values[self._key_field]] = row
+        if self._name_field is not None:
+            self._name_index.setdefault(values[self._name_field], []).append(row)
+        return row
+
+    def extend(self, columns: Dict[str, List]) -> int:
+        # Bulk append; returns the row id of the first new row
+        count = len(next(iter(columns.values())))
+        first = self._size
+        self._reserve(first + count)
+        self._size += count
+        self._write(np.arange(first, first + count), columns, first, unique=True)
+        if self._key_field is not None:
+            for offset, key in enumerate(columns[self._key_field]):
+                self._key_index[key] = first + offset
+        if self._name_field is not None:
+            for offset, name in enumerate(columns[self._name_field]):
+                self._name_index.setdefault(name, []).append(first + offset)
+        return first
+
+    def extend_at(self, rows: np.ndarray, columns: Dict[str, List]):
+        # Bulk append at given ascending row ids past the end; skipped ids become empty rows whose
+        # string fields are None, so records keep the row ids they were stored under
+        rows = np.asarray(rows, dtype=np.int64)
+        if not rows.size:
+            return
+        first = self._size
+        if rows[0] < first or np.any(np.diff(rows) <= 0):
+            raise ValueError("row ids must be ascending and past the last row")
+        self._reserve(int(rows[-1]) + 1)
+        self._size = int(rows[-1]) + 1
+        self._write(rows, columns, first, unique=True)
+        if self._key_field is not None:
+            for row, key in zip(rows.tolist(), columns[self._key_field]):
+                self._key_index[key] = row
+        if self._name_field is not None:
+            for row, name in zip(rows.tolist(), columns[self._name_field]):
+                self._name_index.setdefault(name, []).append(row)
+
+    def upsert(self, key, values: Dict) -> int:
+        # Scalar fast path; avoids the array round trip of upsert_many for single records
+        row = self._key_index.get(key)
+        is_new = row is None
+        if is_new:
+            row = self._key_index[key] = self._size
+            self._reserve(row + 1)
+            self._size += 1
+            values = dict(values)
+            values[self._key_field] = key
+        self._write_row(row, values, is_new)
+        return row
+
+    def upsert_many(self, columns: Dict[str, List], keys: List = None) -> List[int]:
+        # Rows are matched by key; unseen keys get new rows, seen keys are overwritten in place
+        keys = columns[self._key_field] if keys is None else keys
+        first_new = self._size
+        next_row = first_new
+        rows = []
+        for key in keys:
+            row = self._key_index.get(key)
+            if row is None:
+                row = self._key_index[key] = next_row
+                next_row += 1
+            rows.append(row)
+        self._reserve(next_row)
+        self._size = next_row
+        columns = dict(columns)
+        columns[self._key_field] = keys
+        self._write(np.asarray(rows, dtype=np.int64), columns, first_new, unique=len(set(rows)) == len(rows))
+        return rows
+
+    def assign(self, rows: np.ndarray, columns: Dict[str, List]):
+        # In-place update of existing rows addressed by row id
+        rows = np.asarray(rows, dtype=np.int64)
+        self._write(rows, columns, self._size, unique=np.unique(rows).size == rows.size)
+
+    def row_of(self, key):
+        return self._key_index.get(key)
+
+    def rows_of(self, keys: Iterable) -> np.ndarray:
+        # -1 marks keys that are not stored
+        index = self._key_index
+        return np.fromiter((index.get(key, -1) for key in keys), dtype=np.int64)
+
+    def values_at(self, field: str, rows: np.ndarray) -> np.ndarray:
+        # Decoded column values for a set of rows; category lookups for missing rows (-1) give None
+        rows = np.asarray(rows, dtype=np.int64)
+        kind = self._schema[field]
+        column = self._columns[field]
+        if kind == 'category':
+            labels = np.array(self._categories[field] + [None], dtype=object)
+            return labels[np.where(rows >= 0, column[np.maximum(rows, 0)], len(labels) - 1)]
+        if kind == 'str':
+            return np.array([column[row] if row >= 0 else None for row in rows.tolist()], dtype=object)
+        return column[rows]
+
+    def rows_by_name(self, name: str) -> List[int]:
+        return list(self._name_index.get(name, ()))
+
+    def rows_where(self, **criteria) -> List[int]:
+        # Intersects secondary-index posting sets, so cost is proportional to the smallest match
+        matches = None
+        for field, value in criteria.items():
+            code = self._codes[field].get(value)
+            postings = self._postings(field, code)
+            matches = set(postings) if matches is None else matches & postings
+            if not matches:
+                return []
+        return sorted(matches) if matches is not None else list(range(self._size))
+
+    def count_where(self, field: str, value) -> int:
+        return len(self._postings(field, self._codes[field].get(value)))
+
+    def _postings(self, field: str, code) -> set:
+        postings = self._secondary[field]
+        return postings[code] if code is not None and code < len(postings) else set()
+
+    def value(self, row: int, field: str):
+        kind = self._schema[field]
+        raw = self._columns[field][row]
+        if kind == 'str':
+            return raw
+        if kind == 'category':
+            return self._categories[field][raw]
+        if kind == 'epoch':
+            return from_epoch_seconds(float(raw))
+        return raw.item()
+
+    def get(self, row: int) -> Dict:
+        if not 0 <= row < self._size:
+            return None
+        return {field: self.value(row, field) for field in self._schema}
+
+    def row_values(self, row: int) -> Dict:
+        # Like get(), but epoch fields stay in seconds; used to export single rows cheaply
+        values = {}
+        for field, kind in self._schema.items():
+            raw = self._columns[field][row]
+            if kind == 'str':
+                values[field] = raw
+            elif kind == 'category':
+                values[field] = self._categories[field][raw]
+            else:
+                values[field] = raw.item()
+        return values
+
+    def get_record(self, row: int):
+        values = self.get(row)
+        if values is None:
+            return None
+        return self.record_type(**{f.name: values[f.name] for f in fields(self.record_type)})
+
+    def column(self, field: str) -> np.ndarray:
+        # Read-only view over the live rows of a numeric column
+        view = self._columns[field][:self._size]
+        view.flags.writeable = False
+        return view
+
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self._columns.values() if isinstance(column, np.ndarray))
+
+    def _reserve(self, size: int):
+        if size <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        for field, column in self._columns.items():
+            if isinstance(column, np.ndarray):
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:self._size] = column[:self._size]
+                self._columns[field] = grown
+        self._capacity = capacity
+
+    def _encode_one(self, field: str, value) -> int:
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            categories = self._categories[field]
+            if len(categories) == 255:
+                raise ValueError(f"too many distinct values for category '{field}'")
+            code = codes[value] = len(categories)
+            categories.append(value)
+            if field in self._secondary:
+                self._secondary[field].append(set())
+        return code
+
+    def _encode(self, field: str, values: List) -> np.ndarray:
+        distinct, inverse = np.unique(np.asarray(values), return_inverse=True)
+        lookup = np.array([self._encode_one(field, value) for value in distinct.tolist()], dtype=np.uint8)
+        return lookup[inverse.reshape(-1)]
+
+    def _write_row(self, row: int, values: Dict, is_new: bool):
+        for field, value in values.items():
+            kind = self._schema[field]
+            column = self._columns[field]
+            if kind == 'str':
+                if len(column) <= row:
+                    column.extend([None] * (row + 1 - len(column)))
+                column[row] = value
+            elif kind == 'category':
+                code = self._encode_one(field, value)
+                if field in self._secondary:
+                    postings = self._secondary[field]
+                    if not is_new:
+                        postings[column[row]].discard(row)
+                    postings[code].add(row)
+                column[row] = code
+            elif kind == 'epoch':
+                column[row] = to_epoch_seconds(value)
+            else:
+                column[row] = value
+
+    def _write(self, rows: np.ndarray, columns: Dict[str, List], first_new: int, unique: bool):
+        # Rows at or beyond first_new were just allocated and hold no previous values
+        for field, values in columns.items():
+            kind = self._schema[field]
+            column = self._columns[field]
+            if kind == 'str':
+                if len(column) < self._size:
+                    column.extend([None] * (self._size - len(column)))
+                for row, value in zip(rows.tolist(), values):
+                    column[row] = value
+            elif kind == 'category':
+                codes = self._encode(field, values)
+                if field in self._secondary:
+                    self._reindex(field, rows, codes, first_new, unique)
+                column[rows] = codes
+            elif kind == 'epoch':
+                if not isinstance(values, np.ndarray):
+                    values = [to_epoch_seconds(value) for value in values]
+                column[rows] = values
+            else:
+                column[rows] = values
+
+    def _reindex(self, field: str, rows: np.ndarray, codes: np.ndarray, first_new: int, unique: bool):
+        postings = self._secondary[field]
+        previous = self._columns[field][rows]
+        fresh = rows >= first_new
+        if not unique:
+            # A key repeated within the batch: replay row by row so the last write wins
+            current = {}
+            for i in range(rows.size):
+                row = int(rows[i])
+                old = current.get(row, None if fresh[i] else previous[i])
+                if old is not None:
+                    postings[old].discard(row)
+                postings[codes[i]].add(row)
+                current[row] = codes[i]
+            return
+        # Only new rows and rows whose category actually changes touch the posting sets
+        moved = ~fresh & (previous != codes)
+        for code in np.unique(previous[moved]).tolist():
+            postings[code].difference_update(rows[moved & (previous == code)].tolist())
+        touched = fresh | moved
+        for code in np.unique(codes[touched]).tolist():
+            postings[code].update(rows[touched & (codes == code)].tolist())
@@ -0,0 +1,209 @@
+import json
+import operator
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict
+
+import numpy as np
+
+# Thresholds the system shipped with; a rules file replaces them as a whole
+DEFAULT_RULES = {
+    'version': 'default',
+    'tables': {
+        'supplier_risk': {
+            'type': 'bins', 'input': 'credit_score', 'closed': 'left',
+            'edges': [650, 750], 'outputs': ['high', 'medium', 'low']
+        },
+        'onboarding_decision': {
+            'type': 'first_match',
+            'rules': [
+                {'when': {'credit_score': {'gte': 750}, 'risk_level': {'in': ['low']}}, 'then': 'approved'},
+                {'when': {'credit_score': {'lt': 600}}, 'then': 'rejected'}
+            ],
+            'default': 'needs_review'
+        },
+        'churn_risk': {
+            'type': 'bins', 'input': 'churn_probability', 'closed': 'right',
+            'edges': [0.4, 0.7], 'outputs': ['low', 'medium', 'high']
+        },
+        'inventory_risk': {
+            'type': 'bins', 'input': 'inventory_ratio', 'closed': 'left',
+            'edges': [0.5, 0.8], 'outputs': ['critical', 'high', 'normal']
+        }
+    },
+    'parameters': {
+        'alert_threshold_factor': 0.8
+    }
+}
+
+REQUIRED_TABLES = ('supplier_risk', 'onboarding_decision', 'churn_risk', 'inventory_risk')
+REQUIRED_PARAMETERS = ('alert_threshold_factor',)
+
+# Anything else is evaluated on the scalar path with bisect and plain comparisons
+_ARRAY_TYPES = (np.ndarray, list, tuple)
+
+_OPERATORS = {
+    'gte': operator.ge,
+    'gt': operator.gt,
+    'lte': operator.le,
+    'lt': operator.lt,
+    'eq': operator.eq
+}
+
+class BinTable:
+    # Ordered bins over one input. closed='left' means a value equal to an edge falls in the upper
+    # bin (x >= edge), closed='right' in the lower one (x > edge to move up).
+    def __init__(self, name: str, spec: Dict):
+        self.name = name
+        self.input = spec['input']
+        self.edges = [float(edge) for edge in spec['edges']]
+        self.outputs = list(spec['outputs'])
+        if len(self.outputs) != len(self.edges) + 1:
+            raise ValueError(f"table '{name}' needs exactly one more output than edges")
+        if self.edges != sorted(self.edges):
+            raise ValueError(f"table '{name}' edges must be ascending")
+        closed = spec.get('closed', 'left')
+        if closed not in ('left', 'right'):
+            raise ValueError(f"table '{name}' closed must be 'left' or 'right'")
+        self._bisect = bisect_right if closed == 'left' else bisect_left
+        self._side = 'right' if closed == 'left' else 'left'
+        self._edge_array = np.array(self.edges)
+        self._output_array = np.array(self.outputs, dtype=object)
+
+    def __call__(self, value):
+        if not isinstance(value, _ARRAY_TYPES):
+            return self.outputs[self._bisect(self.edges, value)]
+        return self._output_array[self.codes(value)]
+
+    def codes(self, values: np.ndarray) -> np.ndarray:
+        # Bin index per value, for callers that keep categories as small integers
+        return np.searchsorted(self._edge_array, values, side=self._side)
+
+    def next_edge(self, values: np.ndarray) -> np.ndarray:
+        # The edge a value has to cross to move up one bin; NaN in the top bin
+        upper = np.append(self._edge_array, np.nan)
+        return upper[self.codes(values)]
+
+class FirstMatchTable:
+    # Decision table with hit policy FIRST: rules are tried in order, the first whose conditions all
+    # hold decides, otherwise the default applies
+    def __init__(self, name: str, spec: Dict):
+        self.name = name
+        self.default = spec['default']
+        self.rules = []
+        for rule in spec['rules']:
+            conditions = []
+            for field, tests in rule['when'].items():
+                for op, operand in tests.items():
+                    if op != 'in' and op not in _OPERATORS:
+                        raise ValueError(f"table '{name}' uses unknown operator '{op}'")
+                    conditions.append((field, op, operand))
+            self.rules.append((conditions, rule['then']))
+        self._output_array = np.array([then for _, then in self.rules] + [self.default], dtype=object)
+
+    def __call__(self, **inputs):
+        if not any(isinstance(value, _ARRAY_TYPES) for value in inputs.values()):
+            for conditions, then in self.rules:
+                if all(value in operand if op == 'in' else _OPERATORS[op](value, operand)
+                       for value, op, operand in ((inputs[field], op, operand) for field, op, operand in conditions)):
+                    return then
+            return self.default
+        masks = []
+        for conditions, _ in self.rules:
+            mask = True
+            for field, op, operand in conditions:
+                values = np.asarray(inputs[field])
+                mask = mask & (np.isin(values, operand) if op == 'in' else _OPERATORS[op](values, operand))
+            masks.append(mask)
+        size = len(next(iter(inputs.values())))
+        index = np.select([np.broadcast_to(mask, size) for mask in masks], range(len(masks)), len(masks))
+        return self._output_array[index]
+
+_TABLE_TYPES = {
+    'bins': BinTable,
+    'first_match': FirstMatchTable
+}
+
+class CompiledRules:
+    # Immutable once built; the engine swaps whole instances, so readers never see a partial update
+    def __init__(self, spec: Dict):
+        self.version = str(spec['version'])
+        self.tables = {}
+        for name, table in spec['tables'].items():
+            kind = table.get('type', 'bins')
+            if kind not in _TABLE_TYPES:
+                raise ValueError(f"table '{name}' has unknown type '{kind}'")
+            self.tables[name] = _TABLE_TYPES[kind](name, table)
+        self.parameters = dict(spec.get('parameters', {}))
+        missing = [name for name in REQUIRED_TABLES if name not in self.tables]
+        missing += [name for name in REQUIRED_PARAMETERS if name not in self.parameters]
+        if missing:
+            raise ValueError(f"rules version {self.version} is missing {', '.join(missing)}")
+        if not isinstance(self.tables['churn_risk'], BinTable):
+            raise ValueError("churn_risk must be a bins table")
+
+    def __getitem__(self, table: str):
+        return self.tables[table]
+
+    def param(self, name: str):
+        return self.parameters[name]
+
+class RulesEngine:
+    # Holds the active CompiledRules. With a path, the file is polled for changes and recompiled in the
+    # background; a file that fails to compile is reported and the previous version stays active.
+    def __init__(self, path: str = None, poll_interval: float = 2.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._rules = CompiledRules(DEFAULT_RULES)
+        self.last_error = None
+        self._mtime = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if path:
+            self.reload()
+
+    def reload(self) -> bool:
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                with open(self.path) as handle:
+                    compiled = CompiledRules(json.load(handle))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                return False
+            self._mtime = mtime
+            self._rules = compiled
+            self.last_error = None
+            return True
+
+    @property
+    def current(self) -> CompiledRules:
+        # Callers take one snapshot per request, so a reload never splits a batch across two versions
+        if self.path and self._pid != os.getpid():
+            self.start()
+        return self._rules
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+        threading.Thread(target=self._watch, name="rules-watcher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict:
+        return {'version': self._rules.version, 'path': self.path, 'last_error': self.last_error}
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                changed = os.stat(self.path).st_mtime_ns != self._mtime
+            except OSError:
+                continue
+            if changed:
+                self.reload()
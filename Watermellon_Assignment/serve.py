@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+class ProductionServer(BaseApplication):
+    # Runs api_server.app under gunicorn: pre-forked worker processes, each with a thread pool
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from api_server import app
+        return app
+
+def post_worker_init(worker):
+    import api_server
+    api_server.worker.mark_ready()
+
+def worker_exit(server, worker):
+    # Runs after the worker has finished its in-flight requests
+    import api_server
+    api_server.shutdown()
+
+def on_exit(server):
+    shutil.rmtree(os.environ['WATERMELON_WORKER_DIR'], ignore_errors=True)
+
+def main(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Serve the automation API with concurrent workers")
+    parser.add_argument('--bind', default=env('WATERMELON_BIND', '0.0.0.0:5000'))
+    parser.add_argument('--workers', type=int, default=int(env('WATERMELON_WORKERS', 1)))
+    parser.add_argument('--threads', type=int, default=int(env('WATERMELON_THREADS', 8)))
+    parser.add_argument('--keepalive', type=int, default=int(env('WATERMELON_KEEPALIVE', 5)),
+                        help="seconds to hold idle keep-alive connections open")
+    parser.add_argument('--graceful-timeout', type=int, default=int(env('WATERMELON_GRACEFUL_TIMEOUT', 30)),
+                        help="seconds a stopping worker gets to finish in-flight requests")
+    parser.add_argument('--timeout', type=int, default=int(env('WATERMELON_TIMEOUT', 60)))
+    parser.add_argument('--backlog', type=int, default=int(env('WATERMELON_BACKLOG', 2048)))
+    args = parser.parse_args(argv)
+    if args.workers > 1:
+        # State is per process: idempotency keys, top-K views, alert dedup, pending rescores and supplier
+        # ids would each be split across workers, and several workers would share one WATERMELON_DB
+        parser.error("only --workers 1 is supported (add threads or WATERMELON_SHARDS to scale)")
+
+    # Workers publish readiness heartbeats here so /health can report every worker
+    os.environ['WATERMELON_WORKER_DIR'] = tempfile.mkdtemp(prefix='watermelon-workers-')
+    # Admission control sizes its budget from the thread pool of each worker
+    os.environ['WATERMELON_THREADS'] = str(args.threads)
+    os.environ['WATERMELON_WORKERS'] = str(args.workers)
+
+    ProductionServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'keepalive': args.keepalive,
+        'graceful_timeout': args.graceful_timeout,
+        'timeout': args.timeout,
+        'backlog': args.backlog,
+        # Each worker builds its own system after fork so no threads or locks cross the fork
+        'preload_app': False,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+        'on_exit': on_exit
+    }).run()
+
+if __name__ == '__main__':
+    main()
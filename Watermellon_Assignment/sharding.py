@@ -0,0 +1,400 @@
+import atexit
+import heapq
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from automation_system import WatermelonAutomationSystem
+from caching import content_hash
+from extraction import DocumentExtractionStage, load_extractor, local_extractor
+from persistence import SQLitePersistence
+from rules import RulesEngine
+
+def shard_of(key, shards: int) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return zlib.crc32(str(key).encode()) % shards
+
+def shard_path(path: str, index: int) -> str:
+    # 'state-{shard}.db' -> 'state-0.db'; without a placeholder 'state.db' -> 'state.shard0.db'
+    if '{shard}' in path:
+        return path.replace('{shard}', str(index))
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+def same_value(values: List):
+    # Configuration and versions: one value when every shard agrees, the per-shard list otherwise
+    first = values[0]
+    return first if all(value == first for value in values) else values
+
+def merge_stats(parts: List[Dict], sums=(), maxima=(), weighted: Dict[str, str] = None,
+                rates: Dict[str, tuple] = None) -> Dict:
+    # Combines per-shard stats dicts field by field as declared by the caller: counters in sums add up,
+    # maxima take the max, weighted averages ({avg: count field}) are re-weighted by the summed counts
+    # and rates ({rate: (hits, misses)}) are recomputed from the summed counters. Anything not declared
+    # is configuration and passes through same_value.
+    weighted = weighted or {}
+    rates = rates or {}
+    merged = {}
+    for field in dict.fromkeys(field for part in parts for field in part):
+        values = [part[field] for part in parts if field in part]
+        if field in sums:
+            merged[field] = sum(values)
+        elif field in maxima:
+            merged[field] = max(values)
+        elif field in weighted:
+            counts = [part.get(weighted[field], 0) for part in parts if field in part]
+            total = sum(counts)
+            merged[field] = round(sum(v * c for v, c in zip(values, counts)) / total, 3) if total else 0.0
+        elif field in rates:
+            hits, misses = (sum(part.get(name, 0) for part in parts) for name in rates[field])
+            merged[field] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+        else:
+            merged[field] = same_value(values)
+    return merged
+
+def merge_keyed(parts: List[Dict], **spec) -> Dict:
+    # {name: stats} per shard (caches, dispatcher destinations) -> {name: merged stats}
+    names = dict.fromkeys(name for part in parts for name in part)
+    return {name: merge_stats([part[name] for part in parts if name in part], **spec) for name in names}
+
+DISPATCHER_DESTINATION = dict(
+    sums=('queue_depth', 'submitted', 'sent', 'failed', 'dropped', 'retries', 'batches'),
+    # The most recent flush of any shard is not knowable from here; the worst one is reported
+    maxima=('flush_latency_max_ms', 'flush_latency_last_ms'),
+    weighted={'flush_latency_avg_ms': 'batches'}
+)
+CACHE = dict(sums=('size', 'maxsize', 'hits', 'misses', 'evictions', 'expirations'),
+             rates={'hit_rate': ('hits', 'misses')})
+ALERTS = dict(sums=('received', 'suppressed', 'escalations', 'alerts_sent', 'digests_sent', 'pending',
+                    'tracked_products'))
+# workers, timeout and cache_dir are per-shard settings and pass through
+EXTRACTION = dict(sums=('documents', 'cache_hits', 'extracted', 'timeouts', 'errors', 'pool_restarts'),
+                  weighted={'extract_avg_ms': 'extracted'})
+PERSISTENCE = dict(sums=('rows_written', 'commits', 'snapshots', 'errors', 'retries', 'pending_batches'),
+                   maxima=('last_commit_ms',))
+RESCORE = dict(sums=('rescored', 'changed_inputs', 'recency_due', 'marketing_triggered'))
+WARM_START = dict(sums=('suppliers', 'buyers', 'forecasts', 'demand_products'), maxima=('seconds',))
+
+def _merge_dispatcher(parts: List[Dict]) -> Dict:
+    return {
+        'pending': sum(part['pending'] for part in parts),
+        'destinations': merge_keyed([part['destinations'] for part in parts], **DISPATCHER_DESTINATION)
+    }
+
+def _build_shard(index: int, config: Dict) -> WatermelonAutomationSystem:
+    persistence = None
+    if config.get('db'):
+        snapshot_dir = config.get('snapshot_dir')
+        persistence = SQLitePersistence(
+            shard_path(config['db'], index),
+            snapshot_dir=os.path.join(snapshot_dir, f"shard{index}") if snapshot_dir else None,
+            snapshot_interval=config.get('snapshot_interval', 3600.0)
+        )
+    rules = RulesEngine(config.get('rules'), poll_interval=config.get('rules_poll_interval', 2.0))
+    extraction = DocumentExtractionStage(
+        load_extractor(config['extractor']) if config.get('extractor') else local_extractor,
+        workers=config.get('extract_workers'),
+        timeout=config.get('extract_timeout', 10.0),
+        cache_dir=config.get('extract_cache_dir')
+    )
+    return WatermelonAutomationSystem(persistence=persistence, rules=rules, extraction=extraction)
+
+def _serve_shard(conn, index: int, config: Dict):
+    # Shard process: owns one WatermelonAutomationSystem and executes calls in arrival order. Ctrl-C
+    # goes to the whole process group; the coordinator decides when shards stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        system = _build_shard(index, config)
+    except Exception as e:
+        conn.send((None, False, e))
+        return
+    conn.send((None, True, os.getpid()))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        call_id, name, args, kwargs = message
+        try:
+            target = system
+            for part in name.split('.'):
+                target = getattr(target, part)
+            reply = (call_id, True, target(*args, **kwargs))
+        except Exception as e:
+            reply = (call_id, False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # Result or exception that does not pickle
+            conn.send((call_id, False, RuntimeError(f"{name}: {e}")))
+    conn.close()
+
+class _ShardClient:
+    # Pipelined RPC to one shard: any number of request threads may have calls outstanding, and a
+    # reader thread resolves their futures as replies come back. Shards start their own extraction
+    # pools, which daemonic processes may not do, so they are stopped explicitly by close().
+    def __init__(self, index: int, config: Dict, context):
+        self.index = index
+        self._conn, child = context.Pipe()
+        self.process = context.Process(target=_serve_shard, args=(child, index, config),
+                                       name=f"watermelon-shard-{index}")
+        self.process.start()
+        child.close()
+        self._ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._reader = None
+
+    def wait_ready(self):
+        _, ok, value = self._conn.recv()
+        if not ok:
+            self.process.join()
+            raise value
+        self.pid = value
+        self._reader = threading.Thread(target=self._read, name=f"shard-{self.index}-reader", daemon=True)
+        self._reader.start()
+
+    def submit(self, name: str, *args, **kwargs) -> Future:
+        future = Future()
+        with self._send_lock:
+            call_id = next(self._ids)
+            self._pending[call_id] = future
+            self._conn.send((call_id, name, args, kwargs))
+        return future
+
+    def close(self, timeout: float = 10.0):
+        with self._send_lock:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def _read(self):
+        while True:
+            try:
+                call_id, ok, value = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(call_id)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        for future in list(self._pending.values()):
+            future.set_exception(RuntimeError(f"shard {self.index} exited"))
+        self._pending.clear()
+
+class _ShardGroup:
+    # Stands in for a per-system component (dispatcher, alerts, persistence) with merged stats
+    def __init__(self, coordinator: 'ShardedAutomationSystem', component: str, merge):
+        self._coordinator = coordinator
+        self._component = component
+        self._merge = merge
+
+    def stats(self) -> Dict:
+        return self._merge(self._coordinator.call_all(f"{self._component}.stats"))
+
+class _ShardRules:
+    def __init__(self, coordinator: 'ShardedAutomationSystem', path: str):
+        self._coordinator = coordinator
+        self.path = path
+
+    def reload(self) -> bool:
+        return all(self._coordinator.call_all('rules.reload'))
+
+    def status(self) -> Dict:
+        return merge_stats(self._coordinator.call_all('rules.status'))
+
+class ShardedAutomationSystem:
+    # Same interface as WatermelonAutomationSystem, backed by one system per process. Buyers and
+    # products are owned by the shard their id hashes to; suppliers by the shard that onboarded them,
+    # with global id = local id * shards + shard. Single-key calls go to one shard, batches are split
+    # by owner and top-K and stats are gathered from every shard.
+    def __init__(self, shards: int, config: Dict = None):
+        config = dict(config or {})
+        self.shards = shards
+        # Fork while this process has no other threads (api_server builds the system at import time);
+        # otherwise spawn, which is slower to start but safe with threads running
+        forkable = threading.active_count() == 1 and 'fork' in multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if forkable else 'spawn')
+        self._clients = [_ShardClient(index, config, context) for index in range(shards)]
+        for client in self._clients:
+            client.wait_ready()
+        self.dispatcher = _ShardGroup(self, 'dispatcher', _merge_dispatcher)
+        self.alerts = _ShardGroup(self, 'alerts', lambda parts: merge_stats(parts, **ALERTS))
+        self.extraction = _ShardGroup(self, 'extraction', lambda parts: merge_stats(parts, **EXTRACTION))
+        self.persistence = (_ShardGroup(self, 'persistence', lambda parts: merge_stats(parts, **PERSISTENCE))
+                            if config.get('db') else None)
+        self.rules = _ShardRules(self, config.get('rules'))
+        self._closed = False
+        # Registered after multiprocessing's own exit hook, so it runs first: shards are told to stop
+        # before the interpreter waits for its non-daemonic children
+        atexit.register(self.shutdown)
+
+    def call(self, shard: int, name: str, *args, **kwargs):
+        return self._clients[shard].submit(name, *args, **kwargs).result()
+
+    def call_all(self, name: str, *args, **kwargs) -> List:
+        futures = [client.submit(name, *args, **kwargs) for client in self._clients]
+        return [future.result() for future in futures]
+
+    def _scatter(self, name: str, parts: Dict[int, tuple]) -> Dict[int, object]:
+        # parts: shard -> positional args; all shards work concurrently
+        futures = {shard: self._clients[shard].submit(name, *args) for shard, args in parts.items()}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def _global_id(self, shard: int, supplier_id: int) -> int:
+        return supplier_id * self.shards + shard
+
+    def _split_columns(self, columns: Dict[str, List], owners: np.ndarray) -> Dict[int, tuple]:
+        parts = {}
+        for shard in range(self.shards):
+            rows = np.flatnonzero(owners == shard)
+            if rows.size:
+                parts[shard] = (rows, {
+                    field: [values[row] for row in rows.tolist()] if isinstance(values, list) else values
+                    for field, values in columns.items()
+                })
+        return parts
+
+    def _column_length(self, columns: Dict[str, List], key: str) -> int:
+        count = len(columns[key])
+        for field, values in columns.items():
+            if isinstance(values, list) and len(values) != count:
+                raise ValueError(f"column '{field}' has {len(values)} rows, expected {count}")
+        return count
+
+    def _gather_rows(self, name: str, parts: Dict[int, tuple], count: int):
+        # Runs one batch call per shard and puts each shard's results back at their input positions
+        replies = self._scatter(name, {shard: (columns,) for shard, (_, columns) in parts.items()})
+        results = [None] * count
+        for shard, (rows, _) in parts.items():
+            for row, result in zip(rows.tolist(), replies[shard]['results']):
+                results[row] = result
+        return replies, results
+
+    def process_supplier_onboarding(self, invoice_data: Dict, idempotency_key: str = None) -> Dict:
+        # Routed by the same key the shard deduplicates on, so retries land on the same shard
+        shard = shard_of(idempotency_key or content_hash(invoice_data), self.shards)
+        result = self.call(shard, 'process_supplier_onboarding', invoice_data, idempotency_key)
+        return dict(result, supplier_id=self._global_id(shard, result['supplier_id']))
+
+    def process_supplier_onboarding_batch(self, invoices: Dict[str, List]) -> Dict:
+        key = next(field for field, values in invoices.items() if isinstance(values, list))
+        count = self._column_length(invoices, key)
+        owners = np.arange(count) % self.shards
+        replies, results = self._gather_rows('process_supplier_onboarding_batch',
+                                             self._split_columns(invoices, owners), count)
+        for row, result in enumerate(results):
+            result['supplier_id'] = self._global_id(int(owners[row]), result['supplier_id'])
+        return {
+            'count': count,
+            'rule_version': same_value([reply['rule_version'] for reply in replies.values()]) if replies else None,
+            'results': results
+        }
+
+    def predict_churn_and_trigger_marketing(self, buyer_data: Dict) -> Dict:
+        return self.call(shard_of(buyer_data['id'], self.shards), 'predict_churn_and_trigger_marketing', buyer_data)
+
+    def predict_churn_batch(self, buyers: Dict[str, List]) -> Dict:
+        count = self._column_length(buyers, 'id')
+        # One reference time for every shard, as in the single-process batch
+        reference_time = buyers.get('reference_time') or datetime.now()
+        if not isinstance(reference_time, str):
+            reference_time = reference_time.isoformat()
+        buyers = dict(buyers, reference_time=reference_time)
+        owners = np.fromiter((shard_of(buyer_id, self.shards) for buyer_id in buyers['id']),
+                             dtype=np.int64, count=count)
+        replies, results = self._gather_rows('predict_churn_batch', self._split_columns(buyers, owners), count)
+        return {
+            'count': count,
+            'reference_time': reference_time,
+            'rule_version': same_value([reply['rule_version'] for reply in replies.values()]) if replies else None,
+            'results': results
+        }
+
+    def record_buyer_order(self, event: Dict) -> Dict:
+        return self.call(shard_of(event['id'], self.shards), 'record_buyer_order', event)
+
+    def rescore_buyers(self, reference_time: datetime = None) -> Dict:
+        return merge_stats(self.call_all('rescore_buyers', reference_time), **RESCORE)
+
+    def record_sales(self, events: List[Dict]) -> Dict:
+        parts = {}
+        for event in events:
+            parts.setdefault(shard_of(event['product_id'], self.shards), []).append(event)
+        self._scatter('record_sales', {shard: (shard_events,) for shard, shard_events in parts.items()})
+        return {
+            'events_recorded': len(events),
+            'products_tracked': sum(self.call_all('demand_engine.__len__'))
+        }
+
+    def forecast_demand_and_alert(self, product_data: Dict) -> Dict:
+        return self.call(shard_of(product_data['product_id'], self.shards), 'forecast_demand_and_alert', product_data)
+
+    def get_supplier(self, supplier_id: int) -> Dict:
+        shard = supplier_id % self.shards
+        record = self.call(shard, 'get_supplier', supplier_id // self.shards)
+        return None if record is None else dict(record, supplier_id=supplier_id)
+
+    def find_suppliers(self, limit: int = 100, **criteria) -> Dict:
+        replies = self.call_all('find_suppliers', limit, **criteria)
+        suppliers = [
+            dict(record, supplier_id=self._global_id(shard, record['supplier_id']))
+            for shard, reply in enumerate(replies) for record in reply['suppliers']
+        ]
+        return {
+            'count': sum(reply['count'] for reply in replies),
+            'suppliers': heapq.nsmallest(limit, suppliers, key=lambda record: record['supplier_id'])
+        }
+
+    def get_buyer(self, buyer_id: str) -> Dict:
+        return self.call(shard_of(buyer_id, self.shards), 'get_buyer', buyer_id)
+
+    def get_forecast(self, product_id: str) -> Dict:
+        return self.call(shard_of(product_id, self.shards), 'get_forecast', product_id)
+
+    def top_risk_buyers(self, k: int = 50) -> List[Dict]:
+        # Each shard's top k contains every global top-k member it owns
+        candidates = itertools.chain.from_iterable(self.call_all('top_risk_buyers', k))
+        return heapq.nlargest(k, candidates, key=lambda buyer: buyer['churn_probability'])
+
+    def top_risk_products(self, k: int = 50) -> List[Dict]:
+        candidates = itertools.chain.from_iterable(self.call_all('top_risk_products', k))
+        return heapq.nsmallest(k, candidates, key=lambda product: product['inventory_ratio'])
+
+    def cache_stats(self) -> Dict:
+        return merge_keyed(self.call_all('cache_stats'), **CACHE)
+
+    def warm_start(self, source: str = None) -> Dict:
+        # Each shard reloads its own database, or its own file derived from source (see shard_path)
+        replies = self._scatter('warm_start', {
+            shard: (shard_path(source, shard) if source else None,) for shard in range(self.shards)
+        })
+        return merge_stats([replies[shard] for shard in range(self.shards)], **WARM_START)
+
+    def flush(self, timeout: float = None) -> bool:
+        return all(self.call_all('flush', timeout))
+
+    def shutdown(self, drain: bool = True, timeout: float = 10.0):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.call_all('shutdown', drain, timeout)
+        finally:
+            for client in self._clients:
+                client.close(timeout)
@@ -1,11 +1,53 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 from flask_cors import CORS
 import json
 import time
 import threading
+from collections import deque
+from itertools import islice
 from datetime import datetime, timedelta
+from typing import List, Tuple
 from automation_system import WatermelonAutomationSystem
 from demo import ProductionDemo
+from profiling import configured_profiler, install as install_profiling
+
+class EventFeed:
+    # Bounded history of dashboard events for Server-Sent Events. Each event is encoded once when
+    # published, so every connected viewer just copies bytes from the ring buffer.
+    def __init__(self, history: int = 500):
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        self._changed = threading.Condition()
+
+    def publish(self, event_type: str, data) -> int:
+        with self._changed:
+            self._last_id += 1
+            frame = f"id: {self._last_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+            self._events.append((self._last_id, frame.encode('utf-8')))
+            self._changed.notify_all()
+            return self._last_id
+
+    def since(self, cursor: int) -> List[Tuple[int, bytes]]:
+        with self._changed:
+            return self._since(cursor)
+
+    def wait(self, cursor: int, timeout: float) -> List[Tuple[int, bytes]]:
+        with self._changed:
+            self._changed.wait_for(lambda: self._last_id > cursor, timeout)
+            return self._since(cursor)
+
+    def _since(self, cursor: int) -> List[Tuple[int, bytes]]:
+        if not self._events or cursor >= self._last_id:
+            return []
+        # IDs are consecutive, so the cursor maps straight to a buffer offset
+        start = max(cursor - self._events[0][0] + 1, 0)
+        return list(islice(self._events, start, None))
+
+    def can_resume(self, cursor: int) -> bool:
+        # A cursor from before a restart, or older than the buffer, cannot be resumed exactly
+        with self._changed:
+            oldest = self._events[0][0] if self._events else self._last_id + 1
+            return oldest - 1 <= cursor <= self._last_id
 
 class UIDemo:
     def __init__(self):
@@ -16,6 +58,10 @@ class UIDemo:
         self.demo_results = []
         self.current_step = 0
         self.is_running = False
+        self.events = EventFeed()
+        # Same switches as the API; demo steps run outside a request, so they are profiled on their own
+        self.profiler = configured_profiler()
+        install_profiling(self.app, self.profiler, skip=('demo_stream',))
         self.setup_routes()
         
     def setup_routes(self):
@@ -29,6 +75,8 @@ class UIDemo:
                 self.demo_results = []
                 self.current_step = 0
                 self.is_running = True
+                self.events.publish('reset', {})
+                self.publish_status()
                 threading.Thread(target=self.run_demo_with_ui).start()
                 return jsonify({'status': 'started'})
             return jsonify({'status': 'already_running'})
@@ -46,7 +94,37 @@ class UIDemo:
             self.demo_results = []
             self.current_step = 0
             self.is_running = False
+            self.events.publish('reset', {})
+            self.publish_status()
             return jsonify({'status': 'reset'})
+        
+        @self.app.route('/api/demo-stream')
+        def demo_stream():
+            # EventSource sends Last-Event-ID when it reconnects; ?cursor= lets other clients resume
+            cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor') or 0
+            try:
+                cursor = int(cursor)
+            except ValueError:
+                cursor = 0
+            return Response(self.stream_events(cursor), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    def publish_status(self):
+        self.events.publish('status', {'is_running': self.is_running, 'current_step': self.current_step})
+    
+    def stream_events(self, cursor: int, keepalive: float = 15.0):
+        yield b"retry: 2000\n\n"
+        if not self.events.can_resume(cursor):
+            # Missed events are gone; the client clears its view and rebuilds from what is buffered
+            yield b"event: resync\ndata: {}\n\n"
+            cursor = 0
+        frames = self.events.since(cursor)
+        while True:
+            for cursor, frame in frames:
+                yield frame
+            frames = self.events.wait(cursor, keepalive)
+            if not frames:
+                yield b": keepalive\n\n"
     
     def run_demo_with_ui(self):
         steps = [
@@ -79,6 +157,7 @@ class UIDemo:
             
             for step_idx, step in enumerate(steps):
                 self.current_step = batch * 3 + step_idx + 1
+                self.publish_status()
                 
                 step_result = {
                     'title': step['title'],
@@ -88,42 +167,49 @@ class UIDemo:
                 }
                 
                 # Process based on step type
-                if step['type'] == 'supplier':
-                    supplier_data = self.demo.mock_suppliers[batch % len(self.demo.mock_suppliers)]
-                    result = self.system.process_supplier_onboarding(supplier_data)
-                    step_result.update({
-                        'input_data': supplier_data,
-                        'output': result,
-                        'explanation': self.explain_supplier_result(supplier_data, result)
-                    })
+                with self.profiler.profile(f"demo.{step['type']}"):
+                    if step['type'] == 'supplier':
+                        supplier_data = self.demo.mock_suppliers[batch % len(self.demo.mock_suppliers)]
+                        result = self.system.process_supplier_onboarding(supplier_data)
+                        step_result.update({
+                            'input_data': supplier_data,
+                            'output': result,
+                            'explanation': self.explain_supplier_result(supplier_data, result)
+                        })
                     
-                elif step['type'] == 'churn':
-                    buyer_data = self.demo.mock_buyers[batch % len(self.demo.mock_buyers)]
-                    result = self.system.predict_churn_and_trigger_marketing(buyer_data)
-                    step_result.update({
-                        'input_data': buyer_data,
-                        'output': result,
-                        'explanation': self.explain_churn_result(buyer_data, result)
-                    })
+                    elif step['type'] == 'churn':
+                        buyer_data = self.demo.mock_buyers[batch % len(self.demo.mock_buyers)]
+                        result = self.system.predict_churn_and_trigger_marketing(buyer_data)
+                        step_result.update({
+                            'input_data': buyer_data,
+                            'output': result,
+                            'explanation': self.explain_churn_result(buyer_data, result)
+                        })
                     
-                elif step['type'] == 'demand':
-                    product_data = self.demo.mock_products[batch % len(self.demo.mock_products)]
-                    result = self.system.forecast_demand_and_alert(product_data)
-                    step_result.update({
-                        'input_data': product_data,
-                        'output': result,
-                        'explanation': self.explain_demand_result(product_data, result)
-                    })
+                    elif step['type'] == 'demand':
+                        product_data = self.demo.mock_products[batch % len(self.demo.mock_products)]
+                        result = self.system.forecast_demand_and_alert(product_data)
+                        step_result.update({
+                            'input_data': product_data,
+                            'output': result,
+                            'explanation': self.explain_demand_result(product_data, result)
+                        })
                 
                 step_result['status'] = 'completed'
                 step_result['end_time'] = datetime.now().isoformat()
                 batch_results['steps'].append(step_result)
+                self.events.publish('step', {
+                    'batch_number': batch_results['batch_number'],
+                    'batch_timestamp': batch_results['timestamp'],
+                    'step': step_result
+                })
                 
                 time.sleep(2)  # Simulate processing time
             
             self.demo_results.append(batch_results)
         
         self.is_running = False
+        self.publish_status()
     
     def explain_supplier_result(self, input_data, result):
         explanations = []
@@ -133,9 +219,9 @@ class UIDemo:
         
         # Credit scoring explanation
         credit_score = result['credit_score']
-        if credit_score >= 750:
+        if result['risk_level'] == 'low':
             explanations.append(f"💳 Credit score {credit_score:.0f} indicates LOW RISK - excellent financial standing")
-        elif credit_score >= 650:
+        elif result['risk_level'] == 'medium':
             explanations.append(f"💳 Credit score {credit_score:.0f} indicates MEDIUM RISK - requires review")
         else:
             explanations.append(f"💳 Credit score {credit_score:.0f} indicates HIGH RISK - potential rejection")
@@ -150,6 +236,7 @@ class UIDemo:
             explanations.append("⚠️ NEEDS REVIEW - Flagged for manual assessment")
         
         explanations.append("🔄 Result pushed to Zoho CRM for workflow processing")
+        explanations.append(f"📐 Decided under rules version {result['rule_version']}")
         
         return explanations
     
@@ -163,10 +250,14 @@ class UIDemo:
         
         # Churn prediction
         churn_prob = result['churn_probability']
-        if churn_prob > 0.7:
+        risk_level = self.system.rules.current['churn_risk'](churn_prob)
+        if result['action_taken'] == 'already_targeted':
+            explanations.append(f"⚠️ CHURN RISK ({churn_prob:.1%}) unchanged since last analysis")
+            explanations.append("📋 Buyer already in an active retention campaign - no duplicate outreach")
+        elif risk_level == 'high':
             explanations.append(f"🚨 HIGH CHURN RISK ({churn_prob:.1%}) - Immediate intervention required")
             explanations.append("📧 Triggered: Discount email + WhatsApp nudge")
-        elif churn_prob > 0.4:
+        elif risk_level == 'medium':
             explanations.append(f"⚠️ MEDIUM CHURN RISK ({churn_prob:.1%}) - Proactive engagement needed")
             explanations.append("📞 Triggered: Sales rep follow-up task")
         else:
@@ -174,6 +265,7 @@ class UIDemo:
             explanations.append("📊 No immediate action required - continue monitoring")
         
         explanations.append("🎯 Marketing automation triggered via Zoho Campaigns")
+        explanations.append(f"📐 Scored under rules version {result['rule_version']}")
         
         return explanations
     
@@ -198,8 +290,12 @@ class UIDemo:
             explanations.append("🟢 NORMAL RISK - Inventory levels adequate for predicted demand")
             explanations.append("📈 Monitoring continues for trend changes")
         
-        if result['alert_sent']:
-            explanations.append("🚨 Real-time alerts dispatched to supplier network")
+        if result['alert_status'] == 'escalated':
+            explanations.append("🚨 Risk worsened - escalation added to the next supplier alert digest")
+        elif result['alert_sent']:
+            explanations.append("🚨 Alert queued for the next supplier network digest")
+        elif result['alert_status'] == 'suppressed':
+            explanations.append("🔕 Alert already sent for this product - duplicate suppressed")
         
         return explanations
     
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+class WorkerState:
+    # Readiness and load of one serving process. When a registry directory is configured (see
+    # serve.py) each worker publishes a heartbeat file there, so any worker can report all of them.
+    def __init__(self, directory: str = None, heartbeat_interval: float = 2.0):
+        self.directory = directory
+        self.heartbeat_interval = heartbeat_interval
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.ready = False
+        self.in_flight = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def mark_ready(self):
+        self.pid = os.getpid()
+        self.ready = True
+        self._publish()
+        # A thread started before fork does not exist in the child, so check liveness rather than presence
+        if self.directory and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._heartbeat, name="worker-heartbeat", daemon=True)
+            self._thread.start()
+
+    def mark_draining(self):
+        self.ready = False
+        self._publish()
+
+    def shutdown(self):
+        self.ready = False
+        self._stop.set()
+        if self.directory:
+            try:
+                os.remove(self._path())
+            except OSError:
+                pass
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self) -> Dict:
+        return {
+            'pid': self.pid,
+            'ready': self.ready,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'heartbeat': time.time()
+        }
+
+    def workers(self) -> List[Dict]:
+        if not self.directory:
+            return [self.snapshot()]
+        workers = []
+        stale_after = self.heartbeat_interval * 3
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as handle:
+                    worker = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            worker['stale'] = time.time() - worker['heartbeat'] > stale_after
+            workers.append(worker)
+        return sorted(workers, key=lambda worker: worker['pid'])
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"{self.pid}.json")
+
+    def _publish(self):
+        if not self.directory:
+            return
+        # Write-then-rename so readers never see a partial file
+        tmp_path = self._path() + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(tmp_path, self._path())
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            self._publish()